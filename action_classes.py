@@ -1,17 +1,33 @@
+import logging
+
+from dragonfly import RecognitionObserver
 from dragonfly.actions.action_base import ActionBase, ActionError
 try:
     from pyvoice_caster.functional_utils import evaluate_function
+    from pyvoice_caster.instrumentation import timed
     from pyvoice_caster.sublime_client import send_sublime
-    from pyvoice_caster.vscode_client import run_command
+    from pyvoice_caster.vscode_client import (begin_batch, discard_batch,
+                                              flush_batch, queue_command,
+                                              run_command)
 except ImportError:
     from caster_user_content.rules.pyvoice_caster.functional_utils import evaluate_function
+    from caster_user_content.rules.pyvoice_caster.instrumentation import timed
     from caster_user_content.rules.pyvoice_caster.sublime_client import send_sublime
-    from caster_user_content.rules.pyvoice_caster.vscode_client import run_command
+    from caster_user_content.rules.pyvoice_caster.vscode_client import (
+        begin_batch, discard_batch, flush_batch, queue_command, run_command)
 
 __all__ = [
     "SublimeCommand",
 ]
 
+# Whether the VSCodeCommand (and by extension LspExecute) actions of an utterance
+# are gathered and sent to vscode with a single request once the utterance has been
+# processed. This requires a version of the pyvoice extension providing the batch
+# command and changes the ordering relative to other actions, eg keystrokes
+BATCH_VSCODE_COMMANDS = False
+
+logger = logging.getLogger(__name__)
+
 
 class SublimeCommand(ActionBase):
     def __init__(self, command="", parameters={}, extra=None, synchronous=True):
@@ -25,11 +41,12 @@ class SublimeCommand(ActionBase):
         self.synchronous = synchronous
 
     def _execute(self, data):
-        if isinstance(self.parameters, dict):
-            p = self.parameters
-        else:
-            p = evaluate_function(self.parameters, data)
-        send_sublime(self.command, p)
+        with timed("action.SublimeCommand"):
+            if isinstance(self.parameters, dict):
+                p = self.parameters
+            else:
+                p = evaluate_function(self.parameters, data)
+            send_sublime(self.command, p, synchronous=self.synchronous)
 
 
 class VSCodeCommand(ActionBase):
@@ -44,11 +61,41 @@ class VSCodeCommand(ActionBase):
         self.synchronous = synchronous
 
     def _execute(self, data):
-        if isinstance(self.parameters, list):
-            p = self.parameters
-        else:
-            p = evaluate_function(self.parameters, data)
-        run_command(self.command, *p)
+        with timed("action.VSCodeCommand"):
+            if isinstance(self.parameters, list):
+                p = self.parameters
+            else:
+                p = evaluate_function(self.parameters, data)
+            if not queue_command(self.command, *p):
+                run_command(self.command, *p)
+
+
+class VSCodeBatchObserver(RecognitionObserver):
+    """Opens a batch of vscode commands when an utterance is recognized and
+    sends it once all of its actions have been executed"""
+
+    def on_recognition(self, *args, **kwargs):
+        begin_batch()
+
+    def on_post_recognition(self, *args, **kwargs):
+        try:
+            flush_batch()
+        except Exception:
+            logger.exception("Failed to send batch of vscode commands")
+
+    def on_failure(self, *args, **kwargs):
+        discard_batch()
+
+
+# protect against reloads
+try:
+    batch_observer
+except NameError:
+    batch_observer = None
+
+if BATCH_VSCODE_COMMANDS and batch_observer is None:
+    batch_observer = VSCodeBatchObserver()
+    batch_observer.register()
 
 
 # context action
@@ -90,29 +137,71 @@ class LspExecute(ActionBase):
         self.synchronous = synchronous
 
     def _execute(self, data):
-        if isinstance(self.command_args, list):
-            p = self.command_args
-        else:
-            p = evaluate_function(self.command_args, data)
-        action = ContextAction(
-            default=SublimeCommand(
-                "lsp_execute",
-                {
-                    "command_name": self.command_name,
-                    "session_name": self.session_name,
-                    "command_args": p,
-                },
-                synchronous=self.synchronous,
-            ),
-            actions=[
-                (
-                    AppContext(executable="code", title="Visual Studio Code"),
-                    VSCodeCommand(
-                        "pyvoice.lsp_execute",
-                        [self.command_name, p],
-                        synchronous=self.synchronous,
-                    ),
-                ),
-            ],
-        )
-        action.execute(data)
+        with timed("action.LspExecute"):
+            if isinstance(self.command_args, list):
+                p = self.command_args
+            else:
+                p = evaluate_function(self.command_args, data)
+            backend = resolve_lsp_backend()
+            backend(self.command_name, self.session_name, p, self.synchronous)
+
+
+def lsp_execute_sublime(command_name, session_name, command_args, synchronous):
+    send_sublime(
+        "lsp_execute",
+        {
+            "command_name": command_name,
+            "session_name": session_name,
+            "command_args": command_args,
+        },
+        synchronous=synchronous,
+    )
+
+
+def lsp_execute_vscode(command_name, session_name, command_args, synchronous):
+    if not queue_command("pyvoice.lsp_execute", command_name, command_args):
+        run_command("pyvoice.lsp_execute", command_name, command_args)
+
+
+# editors LspExecute can route commands to, as (context, backend) pairs, the
+# first backend whose context matches the foreground window is used
+lsp_backends = []
+default_lsp_backend = lsp_execute_sublime
+
+# foreground window handle of the last execution and the backend it matched
+last_lsp_route = (None, None)
+
+
+def register_lsp_backend(context, backend):
+    """Route LspExecute commands to a new editor
+
+    Args:
+        context (Context): matches the windows of the editor
+        backend (Callable[[str,str,list,bool],None]): sends the command, receiving
+            the command name, session name, command arguments and synchronous flag
+    """
+    global last_lsp_route
+    lsp_backends.append((context, backend))
+    last_lsp_route = (None, None)
+
+
+def resolve_lsp_backend():
+    """Pick the backend for the foreground window, skipping the context
+    matching if it is the same window as in the last execution"""
+    global last_lsp_route
+    window = Window.get_foreground()
+    handle, backend = last_lsp_route
+    if handle is not None and handle == window.handle:
+        return backend
+    backend = default_lsp_backend
+    for context, candidate in lsp_backends:
+        if context.matches(window.executable, window.title, window.handle):
+            backend = candidate
+            break
+    last_lsp_route = (window.handle, backend)
+    return backend
+
+
+register_lsp_backend(
+    AppContext(executable="code", title="Visual Studio Code"), lsp_execute_vscode
+)
@@ -0,0 +1,319 @@
+"""Benchmarks for the rpc and list update hot paths
+
+Runs headless, without Caster or a speech engine: dragonfly is replaced by a
+minimal stub (a plain dict based DictList), unless --real-dragonfly is given,
+and the rpc server listens on a temporary socket with a random key instead of
+the ones of the default service.
+
+Usage (from the root of the repository, Linux only)::
+
+    python benchmarks/bench_hot_paths.py --output bench.json
+
+Pushes are sent both as plain JSON-RPC and in the columnar wire format, and
+the cost of encoding and decoding them is also measured on its own.
+
+The results are written as JSON, timings in milliseconds, so that the output
+of two runs can be compared. Requires ``six`` to be installed.
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import types
+from multiprocessing.connection import Client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LISTS = ("expression", "importable", "subsymbol")
+SIZES = (100, 1000, 10000, 100000)
+
+
+def install_dragonfly_stub():
+    """Register a dragonfly module providing just what the grammar modules use"""
+
+    class DictList(dict):
+        def __init__(self, name, *args, **kwargs):
+            dict.__init__(self, *args, **kwargs)
+            self.name = name
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+        def set(self, other):
+            self.clear()
+            self.update(other)
+
+    class DictListRef(object):
+        def __init__(self, name, dict_list, key=None, default=None):
+            self.name = name
+            self.list = dict_list
+
+    class ActionBase(object):
+        def execute(self, data=None):
+            return self._execute(data)
+
+    class ActionError(Exception):
+        pass
+
+    class RecognitionObserver(object):
+        def register(self):
+            pass
+
+    class AppContext(object):
+        def __init__(self, executable=None, title=None):
+            self.executable = executable
+
+        def matches(self, executable, title, handle):
+            return self.executable in executable
+
+    class Key(object):
+        def __init__(self, spec):
+            self.spec = spec
+
+        def execute(self, data=None):
+            pass
+
+    class Window(object):
+        executable = title = ""
+        handle = None
+
+        @staticmethod
+        def get_foreground():
+            return Window()
+
+    dragonfly = types.ModuleType("dragonfly")
+    actions = types.ModuleType("dragonfly.actions")
+    action_base = types.ModuleType("dragonfly.actions.action_base")
+    for cls in (DictList, DictListRef, RecognitionObserver, AppContext, Key, Window):
+        setattr(dragonfly, cls.__name__, cls)
+    action_base.ActionBase = dragonfly.ActionBase = ActionBase
+    action_base.ActionError = dragonfly.ActionError = ActionError
+    dragonfly.actions = actions
+    actions.action_base = action_base
+    sys.modules.update(
+        {
+            "dragonfly": dragonfly,
+            "dragonfly.actions": actions,
+            "dragonfly.actions.action_base": action_base,
+        }
+    )
+
+
+def load_package():
+    """Import the repository as the pyvoice_caster package, wherever it is checked out"""
+    spec = importlib.util.spec_from_file_location(
+        "pyvoice_caster",
+        os.path.join(ROOT, "__init__.py"),
+        submodule_search_locations=[ROOT],
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["pyvoice_caster"] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+def start_server(rpc):
+    """Serve the default service on a temporary socket, before dict_lists
+    registers its methods, so that they end up on this server
+
+    The socket lives in the abstract namespace, so nothing is left on disk.
+    """
+    address = "\0pyvoice-bench-%d" % os.getpid()
+    authkey = os.urandom(32)
+    server = rpc.RPCServer(address, rpc.JsonRpcRequestHandler, authkey=authkey)
+    server.serve_forever()
+    rpc.SERVERS["default"] = server
+    return address, authkey
+
+
+def connect(address, authkey, timeout=5):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except (IOError, OSError):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def make_items(list_name, size, salt):
+    if list_name == "expression":
+        return [
+            {"spoken": "name %d" % i, "value": "name_%d_%d" % (i, salt)}
+            for i in range(size)
+        ]
+    return [
+        {
+            "spoken": "symbol %d" % i,
+            "module": "package.module_%d" % (i % 50),
+            "name": "symbol_%d_%d" % (i, salt),
+        }
+        for i in range(size)
+    ]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "min": 1000 * samples[0],
+        "median": 1000 * samples[len(samples) // 2],
+        "max": 1000 * samples[-1],
+    }
+
+
+def push_message(request_id, list_name, items):
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "enhance_spoken",
+        "params": [list_name, items],
+    }
+
+
+def bench_pushes(client, rpc, sizes, repeat, wire_format="json"):
+    results = {}
+    request_id = 0
+    for list_name in LISTS:
+        for size in sizes:
+            samples = []
+            for salt in range(repeat):
+                # every push differs, so none is skipped as unchanged
+                message = rpc.encode_message(
+                    push_message(request_id, list_name, make_items(list_name, size, salt)),
+                    wire_format,
+                )
+                request_id += 1
+                start = time.time()
+                client.send_bytes(message)
+                response = json.loads(client.recv_bytes().decode("utf-8"))
+                samples.append(time.time() - start)
+                if "error" in response:
+                    raise RuntimeError(response["error"])
+            results["%s/%d" % (list_name, size)] = summarize(samples)
+    return results
+
+
+def bench_codec(rpc, dict_lists, sizes, repeat):
+    """Time encoding a push in each wire format, as an editor would, and decoding
+    it into the items stored in the list, without the transport"""
+    results = {}
+    for wire_format in rpc.WIRE_FORMATS:
+        for size in sizes:
+            message = push_message(0, "importable", make_items("importable", size, 0))
+            encode = []
+            decode = []
+            for _ in range(repeat):
+                start = time.time()
+                data = rpc.encode_message(message, wire_format)
+                encode.append(time.time() - start)
+                start = time.time()
+                params = rpc.decode_message(data)["params"]
+                dict(dict_lists.compact_items(params[1], {}))
+                decode.append(time.time() - start)
+            key = "%s/importable/%d" % (wire_format, size)
+            results[key] = {
+                "bytes": len(data),
+                "encode": summarize(encode),
+                "decode": summarize(decode),
+            }
+    return results
+
+
+def bench_calls(number):
+    from pyvoice_caster.action_classes import LspExecute, SublimeCommand, VSCodeCommand
+    from pyvoice_caster.functional_utils import evaluate_function
+
+    data = {
+        "importable": {"module": "os", "name": "path"},
+        "every": False,
+        "name": "join",
+        "_grammar": None,
+        "_rule": None,
+        "_node": None,
+    }
+
+    def from_import(importable, every, name):
+        return ["$file_uri", importable, name, every]
+
+    timers = {
+        "evaluate_function": lambda: evaluate_function(from_import, data),
+        "SublimeCommand()": lambda: SublimeCommand("insert", {"characters": "x"}),
+        "VSCodeCommand()": lambda: VSCodeCommand("pyvoice.insert", from_import),
+        "LspExecute()": lambda: LspExecute("from_import_fuzzy", from_import),
+    }
+    results = {}
+    for name, function in timers.items():
+        seconds = min(timeit.repeat(function, number=number, repeat=5))
+        results[name] = {"calls": number, "per_call_us": 1e6 * seconds / number}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--output", help="file to write the results to, stdout by default")
+    parser.add_argument(
+        "--real-dragonfly",
+        action="store_true",
+        help="use the installed dragonfly instead of the stub",
+    )
+    args = parser.parse_args()
+
+    if not args.real_dragonfly:
+        install_dragonfly_stub()
+    load_package()
+    rpc = importlib.import_module("pyvoice_caster.rpc")
+    address, authkey = start_server(rpc)
+    dict_lists = importlib.import_module("pyvoice_caster.dict_lists")
+    importlib.import_module("pyvoice_caster.import_index")
+    instrumentation = importlib.import_module("pyvoice_caster.instrumentation")
+    # apply every push before answering it and never truncate, so that the
+    # round trip covers the whole update and runs are comparable. Warm starts
+    # are disabled, so that the snapshots of the user are neither loaded nor
+    # overwritten with synthetic items
+    dict_lists.scheduler.quiet_window = 0
+    dict_lists.COMPILE_TIME_TARGET_SECONDS = None
+    dict_lists.WARM_START_DIR = None
+    for list_name in LISTS:
+        dict_lists.dynamic_list(list_name)
+
+    client = connect(address, authkey)
+    try:
+        pushes = bench_pushes(client, rpc, args.sizes, args.repeat)
+        columnar_pushes = bench_pushes(client, rpc, args.sizes, args.repeat, "columnar")
+    finally:
+        client.close()
+    results = {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "dragonfly": "real" if args.real_dragonfly else "stub",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "pushes": pushes,
+        "columnar_pushes": columnar_pushes,
+        "codec": bench_codec(rpc, dict_lists, args.sizes, args.repeat),
+        "stages": instrumentation.get_stats(),
+        "calls": bench_calls(args.calls),
+    }
+
+    encoded = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(encoded)
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
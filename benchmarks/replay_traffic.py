@@ -0,0 +1,152 @@
+"""Replay traffic recorded by the voicerpc server against a running server
+
+Record some real editor traffic by setting ``RECORD_TRAFFIC_FILE`` in
+``rpc.py``, for instance to ``"~/.voicerpc/{service}.rec"``, then feed it back
+into a server, keeping the original connections apart and the original timing
+between messages, scaled by ``--speed`` (0 sends as fast as possible)::
+
+    python benchmarks/replay_traffic.py ~/.voicerpc/default.rec --speed 4
+
+The throughput and the response times per method are written as JSON.
+"""
+import argparse
+import json
+import threading
+import time
+from multiprocessing.connection import Client
+
+from bench_hot_paths import load_package
+
+
+class ReplayConnection(object):
+    """Client connection replaying the messages of one recorded connection and
+    timing the responses to them"""
+
+    def __init__(self, rpc, instrumentation, address, authkey):
+        self.rpc = rpc
+        self.instrumentation = instrumentation
+        self.client = Client(address, authkey=authkey)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.histograms = {}
+        self.thread = threading.Thread(target=self._receive)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, data):
+        try:
+            payload = self.rpc.decode_message(data)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict) and payload.get("id") is not None:
+            with self.lock:
+                self.pending[payload["id"]] = (time.time(), payload.get("method"))
+        self.client.send_bytes(data)
+
+    def _receive(self):
+        while True:
+            try:
+                response = json.loads(self.client.recv_bytes().decode("utf-8"))
+            except (EOFError, IOError, OSError):
+                return
+            if not isinstance(response, dict):
+                continue
+            with self.lock:
+                sent = self.pending.pop(response.get("id"), None)
+            if sent is None:
+                continue
+            start, method = sent
+            histogram = self.histograms.get(method)
+            if histogram is None:
+                histogram = self.histograms[method] = self.instrumentation.Histogram()
+            histogram.record(time.time() - start)
+
+    def drain(self, deadline):
+        while self.pending and time.time() < deadline:
+            time.sleep(0.01)
+        self.client.close()
+        return len(self.pending)
+
+
+def replay(rpc, instrumentation, path, address, authkey, speed):
+    connections = {}
+    count = 0
+    first = None
+    start = time.time()
+    # read it all up front, the server may be appending the replayed messages to it
+    records = list(rpc.read_recording(path))
+    for timestamp, connection_id, data in records:
+        if first is None:
+            first = timestamp
+        if speed > 0:
+            delay = start + (timestamp - first) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        connection = connections.get(connection_id)
+        if connection is None:
+            connection = connections[connection_id] = ReplayConnection(
+                rpc, instrumentation, address, authkey
+            )
+        connection.send(data)
+        count += 1
+    return connections, count, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recording")
+    parser.add_argument("--service", default="default")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30.0,
+        help="how long to wait for outstanding responses after the last message",
+    )
+    parser.add_argument("--output", help="file to write the results to, stdout by default")
+    args = parser.parse_args()
+
+    load_package()
+    from pyvoice_caster import instrumentation, rpc
+
+    start = time.time()
+    connections, count, elapsed = replay(
+        rpc,
+        instrumentation,
+        args.recording,
+        rpc.get_server_path(args.service),
+        rpc.get_credentials(args.service),
+        args.speed,
+    )
+    deadline = time.time() + args.drain_timeout
+    unanswered = sum(connection.drain(deadline) for connection in connections.values())
+    total = time.time() - start
+    methods = {}
+    for connection in connections.values():
+        for method, histogram in connection.histograms.items():
+            merged = methods.setdefault(method, instrumentation.Histogram())
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.count += histogram.count
+            merged.total += histogram.total
+            merged.max = max(merged.max, histogram.max)
+    results = {
+        "recording": args.recording,
+        "speed": args.speed,
+        "messages": count,
+        "connections": len(connections),
+        "send_seconds": elapsed,
+        "total_seconds": total,
+        "messages_per_second": count / total if total else None,
+        "unanswered": unanswered,
+        "methods": {method: h.summary() for method, h in methods.items()},
+    }
+    encoded = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(encoded)
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,167 @@
 import datetime
+import hashlib
+import heapq
+import json
 import logging
+import marshal
+import os
+import threading
+import time
+from collections import OrderedDict
 
+import six
 from dragonfly import DictList, DictListRef
 
 try:
-    from pyvoice_caster.rpc import add_method
+    from collections.abc import Mapping
 except ImportError:
-    from caster_user_content.rules.pyvoice_caster.rpc import add_method
+    from collections import Mapping
+
+try:
+    from pyvoice_caster.instrumentation import record
+    from pyvoice_caster.rpc import (add_lane_key, add_method, is_table,
+                                    notify_broker)
+except ImportError:
+    from caster_user_content.rules.pyvoice_caster.instrumentation import record
+    from caster_user_content.rules.pyvoice_caster.rpc import (
+        add_lane_key, add_method, is_table, notify_broker)
 
 __all__ = [
     "dynamic_list",
     "dynamic_list_reference",
 ]
 
-lists = {}
+# How long a list needs to receive no pushes before the pending update is applied,
+# in seconds. Setting it to zero applies every push immediately on the rpc thread
+UPDATE_QUIET_WINDOW_SECONDS = 0.25
+
+# Upper bound on how long a pending update may be held back while pushes keep
+# arriving, in seconds
+UPDATE_MAX_DELAY_SECONDS = 1.0
+
+# How many (file, scope) snapshots of the lists to keep around, and the total
+# number of items they may hold between them, as a proxy for their memory use
+SNAPSHOT_CACHE_SIZE = 16
+SNAPSHOT_CACHE_MAX_ITEMS = 200000
+
+# where the contents of the lists are saved after every applied push, so that they
+# can be restored when the grammar is loaded again, per service and project. None
+# disables warm starts. Saving a list waits at least WARM_START_WRITE_INTERVAL_SECONDS
+# since the previous save, only the latest contents are written
+WARM_START_DIR = os.path.join("~", ".voicerpc", "snapshots", "{service}")
+WARM_START_SERVICE = "default"
+WARM_START_WRITE_INTERVAL_SECONDS = 5.0
+
+# precedence of the layers of a layered list like expression.local, when the
+# same spoken form appears in several of them the later layer wins. Layers not
+# mentioned here rank below all of them
+LAYER_ORDER = ("module", "class", "local")
+
+# most items a list may hold, by list name or by layer name like expression.local.
+# The budget of a list covers all of its layers together, the budget of a layer
+# further limits that layer. Lists not mentioned are only limited through
+# COMPILE_TIME_TARGET_SECONDS
+LIST_ITEM_BUDGETS = {}
+
+# how long applying a full push to a list should take, in seconds, from which
+# together with the measured time per item a budget is derived for every list,
+# for instance 2.0. None disables the derived budgets, as editors do not send
+# scores yet, so truncating would keep arbitrary items until usage is known.
+# They never go below MIN_ITEM_BUDGET
+COMPILE_TIME_TARGET_SECONDS = None
+MIN_ITEM_BUDGET = 500
+
+# functions ranking the items of a list when it has to be truncated, by list
+# name. They are called as ranker(list_name, spoken, item) and the items with
+# the highest keys are kept. Lists not mentioned use rank_item
+LIST_RANKERS = {}
+
+# protect against reloads, so that editing a grammar file does not throw away
+# the lists along with everything known about them and force the editor to
+# push them again. Each variable is guarded on its own, so that state added by
+# a newer version of this file is defined when it is reloaded. Methods
+# registered with the rpc server are replaced by name
+try:
+    lists
+except NameError:
+    lists = {}
+
+# version of the contents of each list, as assigned by the editor that pushed them
+try:
+    versions
+except NameError:
+    versions = {}
+
+try:
+    versions_lock
+except NameError:
+    versions_lock = threading.Lock()
+
+# shared string tables used to intern the repeated parts of the items of each list
+try:
+    string_tables
+except NameError:
+    string_tables = {}
+
+# fingerprint of the last full contents scheduled for each list, and how many
+# identical pushes have been skipped because of it
+try:
+    fingerprints
+except NameError:
+    fingerprints = {}
+
+try:
+    skipped_pushes
+except NameError:
+    skipped_pushes = {}
+
+# chunked uploads still being received, keyed by the name of their list
+try:
+    uploads
+except NameError:
+    uploads = {}
+
+# items of each layer of the layered lists, keyed by base list name and layer
+try:
+    layers
+except NameError:
+    layers = {}
+
+# measured seconds per item it takes to apply an update to each list
+try:
+    item_costs
+except NameError:
+    item_costs = {}
+
+# how often and when each spoken form of a list was last recognized
+try:
+    usage
+except NameError:
+    usage = {}
+
+# how many items had to be dropped from the last push of each list or layer
+try:
+    dropped_items
+except NameError:
+    dropped_items = {}
+
+# lists whose contents were restored from a warm start snapshot and have not
+# received a push yet, and the project each list was last pushed for
+try:
+    restored
+except NameError:
+    restored = set()
+
+try:
+    list_projects
+except NameError:
+    list_projects = {}
+
+# callbacks to run after updates to a list have been applied, keyed by list name
+try:
+    list_listeners
+except NameError:
+    list_listeners = {}
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -21,31 +169,1060 @@ logger.setLevel(logging.INFO)
 def dynamic_list(name, *args, **kwargs):
     if name not in lists:
         lists[name] = DictList(name, *args, **kwargs)
+        restore_warm_start(name)
     return lists[name]
 
 
+def add_list_listener(name, callback):
+    """Run ``callback(name, dict_list)`` on the updating thread after every
+    update of the list has been applied
+
+    A callback replaces any previously added one with the same module and name,
+    so that modules can add their listeners again when they are reloaded
+    """
+    identity = (getattr(callback, "__module__", None), getattr(callback, "__name__", None))
+    callbacks = [
+        c
+        for c in list_listeners.get(name, [])
+        if (getattr(c, "__module__", None), getattr(c, "__name__", None)) != identity
+    ]
+    callbacks.append(callback)
+    list_listeners[name] = callbacks
+
+
 def dynamic_list_reference(reference_name, name=None, *args, **kwargs):
     if name is None:
         name = reference_name
-    return DictListRef(name, dynamic_list(name, *args, **kwargs))
+    return UsageRecordingDictListRef(name, dynamic_list(name, *args, **kwargs))
 
 
-@add_method()
-def enhance_spoken(list_name, data):
+class UsageRecordingDictListRef(DictListRef):
+    """DictListRef that records which items get recognized, so that the most
+    used ones are kept when a list has to be truncated"""
+
+    def value(self, node):
+        item = DictListRef.value(self, node)
+        record_use(self.list.name, " ".join(node.words()))
+        return item
+
+
+def record_use(list_name, spoken):
+    entry = usage.setdefault(list_name, {}).setdefault(spoken, [0, 0.0])
+    entry[0] += 1
+    entry[1] = time.time()
+
+
+############################## COMPACT ITEMS ##############################
+#
+# projects push thousands of items, each repeating module paths like os.path,
+# so instead of keeping the incoming dicts alive we store them as slotted
+# records whose repeated strings are shared through a per list string table
+#
+###########################################################################
+
+ITEM_FIELDS = ("spoken", "value", "module", "name")
+INTERNED_FIELDS = ("module", "name")
+
+# protect against reloads, items created before a reload keep referencing it
+try:
+    _MISSING
+except NameError:
+    _MISSING = object()
+
+
+def intern_string(strings, value):
+    if isinstance(value, six.string_types):
+        return strings.setdefault(value, value)
+    return value
+
+
+class SpokenItem(Mapping):
+    """Read only mapping holding one item of a dynamic list
+
+    It behaves like the dict pushed by the editor, so grammar callbacks can keep
+    accessing ``item["module"]`` etc, and can be converted back with ``dict(item)``
+    """
+
+    __slots__ = ITEM_FIELDS + ("extra",)
+
+    def __init__(self, data, strings):
+        present = 0
+        for field in ITEM_FIELDS:
+            value = data.get(field, _MISSING)
+            if value is not _MISSING:
+                present += 1
+                if field in INTERNED_FIELDS:
+                    value = intern_string(strings, value)
+            setattr(self, field, value)
+        self.extra = None
+        if len(data) > present:
+            self.extra = {k: v for k, v in data.items() if k not in ITEM_FIELDS}
+
+    def __getitem__(self, key):
+        if key in ITEM_FIELDS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for field in ITEM_FIELDS:
+            if getattr(self, field) is not _MISSING:
+                yield field
+        if self.extra is not None:
+            for key in self.extra:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "SpokenItem({!r})".format(dict(self))
+
+    def __reduce__(self):
+        # rebuild from the mapping, copying the slots would also copy the
+        # _MISSING sentinel of absent fields into a new, unrecognized object
+        return (self.__class__, (dict(self), {}))
+
+
+def compact_items(data, strings):
+    """Turn the items of a push into (spoken, SpokenItem) pairs
+
+    Args:
+        data (List[dict]): the items, or the columnar table of them when they
+            were sent in the columnar wire format
+        strings (dict): the string table of the list
+    """
+    if is_table(data):
+        return compact_rows(data["$columns"], data["$rows"], strings)
+    return [(x["spoken"], SpokenItem(x, strings)) for x in data]
+
+
+def compact_rows(columns, rows, strings):
+    """Same as compact_items, reading the fields straight from the rows of a
+    columnar table instead of building a dict per item first"""
+    positions = dict((column, index) for index, column in enumerate(columns))
+    spoken = positions["spoken"]
+    value = positions.get("value")
+    module = positions.get("module")
+    name = positions.get("name")
+    extra = [(c, i) for c, i in positions.items() if c not in ITEM_FIELDS]
+    new = SpokenItem.__new__
+    pairs = []
+    for row in rows:
+        item = new(SpokenItem)
+        item.spoken = row[spoken]
+        item.value = _MISSING if value is None else row[value]
+        item.module = _MISSING if module is None else intern_string(strings, row[module])
+        item.name = _MISSING if name is None else intern_string(strings, row[name])
+        item.extra = {c: row[i] for c, i in extra} if extra else None
+        pairs.append((item.spoken, item))
+    return pairs
+
+
+############################## COALESCING OF LIST UPDATES ##############################
+#
+# every update of a DictList triggers a grammar recompile, so instead of applying
+# each push on the rpc thread, we hold it back until the editor goes quiet and
+# only apply the latest state
+#
+#########################################################################################
+
+
+def set_items(items):
+    def operation(dict_list):
+        dict_list.set(items)
+
+    return operation
+
+
+def update_items(added, removed):
+    def operation(dict_list):
+        for spoken in removed:
+            dict_list.pop(spoken, None)
+        dict_list.update(added)
+
+    return operation
+
+
+def apply_operations(list_name, operations):
+    dict_list = lists[list_name]
     start = datetime.datetime.now()
-    with lists[list_name]:
-        lists[list_name].set({x["spoken"]: x for x in data})
+    with dict_list:
+        for operation in operations:
+            operation(dict_list)
     end = datetime.datetime.now()
+    record("list.set." + list_name, (end - start).total_seconds())
+    if len(dict_list) >= MIN_ITEM_BUDGET:
+        cost = (end - start).total_seconds() / len(dict_list)
+        previous = item_costs.get(list_name)
+        item_costs[list_name] = cost if previous is None else (previous + cost) / 2
     logger.info(
         "Enhanced list %s with %s items over %s seconds (%s until %s)",
         list_name,
-        len(data),
+        len(dict_list),
         (end - start).total_seconds(),
         start,
         end
     )
+    if WARM_START_DIR is not None:
+        warm_start_writer.schedule(list_name, list(dict_list.values()))
+    notify_listeners(list_name, dict_list)
+
+
+def notify_listeners(list_name, dict_list):
+    for callback in list_listeners.get(list_name, ()):
+        try:
+            callback(list_name, dict_list)
+        except Exception:
+            logger.exception("Listener of list %s failed", list_name)
+
+
+class ListUpdateScheduler(object):
+    """Collects the pending operations of every list and applies them from a
+    background thread once the list has been quiet for ``quiet_window`` seconds,
+    but no later than ``max_delay`` seconds after the first pending push.
+
+    A full replacement of a list discards any operations still pending for it,
+    so stale payloads never reach the grammar.
+    """
+
+    def __init__(self, quiet_window, max_delay):
+        self.quiet_window = quiet_window
+        self.max_delay = max_delay
+        self.sequence = 0
+        # sequence of the last push applied to each list, every earlier push
+        # to the list is in effect as well
+        self.applied = {}
+        # lists an update failed for, their applied sequence stays put until a
+        # full replacement of them succeeds
+        self.failed = set()
+        self._pending = {}
+        self._deadlines = {}
+        self._condition = threading.Condition(threading.Lock())
+        self._thread = None
+
+    def submit(self, list_name, operation, replace=False):
+        """Schedule an operation for the given list
+
+        Args:
+            list_name (str): the name of the list the operation applies to
+            operation (Callable[[DictList], None]): the mutation to perform
+            replace (bool): whether the operation overwrites the whole list,
+                making every operation still pending for it obsolete
+
+        Returns:
+            int: sequence number acknowledging the push
+        """
+        with self._condition:
+            self.sequence += 1
+            sequence = self.sequence
+            if self.quiet_window <= 0:
+                operations = [operation]
+            else:
+                now = time.time()
+                first_push = now
+                if list_name in self._pending:
+                    first_push = self._deadlines[list_name][1]
+                if replace or list_name not in self._pending:
+                    self._pending[list_name] = []
+                self._pending[list_name].append((sequence, operation, replace))
+                self._deadlines[list_name] = (
+                    min(now + self.quiet_window, first_push + self.max_delay),
+                    first_push,
+                )
+                self._ensure_thread()
+                self._condition.notify()
+                return sequence
+        try:
+            apply_operations(list_name, operations)
+        except Exception:
+            self.failed.add(list_name)
+            raise
+        self._applied(list_name, sequence, replace)
+        return sequence
+
+    def _pop(self, list_name):
+        del self._deadlines[list_name]
+        return self._pending.pop(list_name)
+
+    def _apply(self, list_name, pending):
+        try:
+            apply_operations(list_name, [operation for _, operation, _ in pending])
+        except Exception:
+            logger.exception("Failed to apply pending updates to list %s", list_name)
+            self.failed.add(list_name)
+            return
+        # a full replacement discards whatever was pending before it, so when
+        # there is one it comes first
+        self._applied(list_name, pending[-1][0], pending[0][2])
+
+    def _applied(self, list_name, sequence, replace):
+        if replace:
+            self.failed.discard(list_name)
+        if list_name not in self.failed:
+            self.applied[list_name] = sequence
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.time()
+                    due = [
+                        name
+                        for name, (deadline, _) in self._deadlines.items()
+                        if deadline <= now
+                    ]
+                    if due:
+                        break
+                    timeout = None
+                    if self._deadlines:
+                        timeout = min(d for d, _ in self._deadlines.values()) - now
+                    self._condition.wait(timeout)
+                due = [(name, self._pop(name)) for name in due]
+            for name, pending in due:
+                self._apply(name, pending)
+
+
+# protect against reloads, pending updates stay with the running thread
+try:
+    scheduler
+except NameError:
+    scheduler = ListUpdateScheduler(UPDATE_QUIET_WINDOW_SECONDS, UPDATE_MAX_DELAY_SECONDS)
+else:
+    scheduler.quiet_window = UPDATE_QUIET_WINDOW_SECONDS
+    scheduler.max_delay = UPDATE_MAX_DELAY_SECONDS
+
+
+@add_method()
+def get_applied_sequence(list_name):
+    """How far the pushes to a list have reached the grammar
+
+    Args:
+        list_name (str): the name of the list, or of one of its layers
+
+    Returns:
+        int: the ``sequence`` of the last push applied to the list, every push
+        acknowledged with a sequence up to it is in effect. 0 if none was
+    """
+    return scheduler.applied.get(split_layer(list_name)[0], 0)
+
+
+############################## LAYERED LISTS ##############################
+#
+# the editor may push a list like expression as independent layers named
+# expression.module, expression.class and expression.local, so that when only
+# the locals change only that layer is resent. The grammar keeps referencing
+# the merged list, which receives only the difference the layer made
+#
+###########################################################################
+
+
+def split_layer(list_name):
+    """Resolve the name a push was addressed to
+
+    Returns:
+        tuple: ``(list_name, None)`` for plain lists and ``(base, layer)`` for
+        names like ``expression.local`` whose base is a known list
+
+    Raises:
+        KeyError: if neither the list nor its base exist
+    """
+    if list_name in lists:
+        return list_name, None
+    base, _, layer = list_name.partition(".")
+    if layer and base in lists:
+        return base, layer
+    raise KeyError(list_name)
+
+
+def layer_rank(layer):
+    return LAYER_ORDER.index(layer) if layer in LAYER_ORDER else -1
+
+
+def list_lane(list_name, *args, **kwargs):
+    """Requests for a list and for its layers all update the same merged list,
+    so they share the lane of its base name"""
+    return list_name.partition(".")[0]
+
+
+def merge_layer(base, layer, items):
+    """Replace the items of a layer and compute what changes in the merged list
+
+    Args:
+        base (str): the name of the merged list
+        layer (str): the name of the layer being replaced
+        items (dict): the new items of the layer, keyed by their spoken form
+
+    Returns:
+        tuple: ``(added, removed)`` to apply to the merged list via ``update_items``
+    """
+    base_layers = layers.setdefault(base, {})
+    previous = base_layers.get(layer, {})
+    base_layers[layer] = items
+    rank = layer_rank(layer)
+    higher = [v for k, v in base_layers.items() if k != layer and layer_rank(k) > rank]
+    lower = sorted(
+        (
+            (layer_rank(k), v)
+            for k, v in base_layers.items()
+            if k != layer and layer_rank(k) <= rank
+        ),
+        key=lambda pair: pair[0],
+        reverse=True,
+    )
+    added = []
+    removed = []
+    for spoken, item in items.items():
+        if not any(spoken in shadowing for shadowing in higher):
+            added.append((spoken, item))
+    for spoken in previous:
+        if spoken in items or any(spoken in shadowing for shadowing in higher):
+            continue
+        for _, shadowed in lower:
+            if spoken in shadowed:
+                added.append((spoken, shadowed[spoken]))
+                break
+        else:
+            removed.append(spoken)
+    return added, removed
+
+
+def forget_layers(base):
+    """Drop the layers of a list along with the versions and fingerprints of
+    their pushes, so that the next push of each layer is applied in full"""
+    layers.pop(base, None)
+    prefix = base + "."
+    for state in (versions, fingerprints, string_tables):
+        for name in [name for name in state if name.startswith(prefix)]:
+            del state[name]
+
+
+def submit_items(list_name, items):
+    base, layer = split_layer(list_name)
+    items = govern_items(list_name, base, items)
+    was_restored = base in restored
+    restored.discard(base)
+    if layer is None:
+        # a full push of the merged list supersedes whatever layers it had
+        forget_layers(list_name)
+        return scheduler.submit(list_name, set_items(items), replace=True)
+    # the merged list no longer matches the last full push of it
+    fingerprints.pop(base, None)
+    added, removed = merge_layer(base, layer, items)
+    if was_restored:
+        # the restored contents are not accounted for in any layer
+        merged = {}
+        for _, layer_items in sorted(layers[base].items(), key=lambda p: layer_rank(p[0])):
+            merged.update(layer_items)
+        return scheduler.submit(base, set_items(merged), replace=True)
+    logger.debug(
+        "Layer %s changes %s items and removes %s from list %s",
+        layer,
+        len(added),
+        len(removed),
+        base,
+    )
+    return scheduler.submit(base, update_items(added, removed))
+
+
+############################## GRAMMAR SIZE GOVERNOR ##############################
+#
+# the time the speech engine needs to compile a list grows with its size, so
+# pushes larger than the budget of their list are truncated to the best ranked
+# items. The pushes of a layer are truncated to what the other layers of the
+# list leave of its budget, and plain lists are truncated again after a delta
+# grew them past it. Budgets come from LIST_ITEM_BUDGETS and from the time per
+# item measured while applying previous updates, measured against
+# COMPILE_TIME_TARGET_SECONDS
+#
+###################################################################################
+
+
+def item_budget(list_name, base):
+    """Most items a push to list_name may keep, None if it is not limited
+
+    The budget of a list bounds its merged contents, so a layer only gets what
+    the other layers of its list leave of it, and less if it has a budget of
+    its own
+    """
+    budget = LIST_ITEM_BUDGETS.get(base)
+    cost = item_costs.get(base)
+    if COMPILE_TIME_TARGET_SECONDS is not None and cost:
+        derived = max(MIN_ITEM_BUDGET, int(COMPILE_TIME_TARGET_SECONDS / cost))
+        budget = derived if budget is None else min(budget, derived)
+    if list_name == base:
+        return budget
+    if budget is not None:
+        prefix = base + "."
+        used = sum(
+            len(layer_items)
+            for layer, layer_items in layers.get(base, {}).items()
+            if prefix + layer != list_name
+        )
+        budget = max(0, budget - used)
+    own = LIST_ITEM_BUDGETS.get(list_name)
+    if own is not None:
+        budget = own if budget is None else min(budget, own)
+    return budget
+
+
+def rank_item(list_name, spoken, item):
+    """Default ranking, the score the editor assigned to the item plus how
+    often it was recognized, with ties broken by the most recently used"""
+    count, last_used = usage.get(list_name, {}).get(spoken, (0, 0.0))
+    return (item.get("score", 0) + count, last_used)
+
+
+def govern_items(list_name, base, items):
+    """Truncate the items of a push to the budget of their list
+
+    Returns:
+        dict: the items to keep, keyed by their spoken form
+    """
+    budget = item_budget(list_name, base)
+    if budget is None or len(items) <= budget:
+        dropped_items[list_name] = 0
+        return items
+    ranker = LIST_RANKERS.get(list_name, LIST_RANKERS.get(base, rank_item))
+    kept = dict(
+        heapq.nlargest(
+            budget, items.items(), key=lambda pair: ranker(base, pair[0], pair[1])
+        )
+    )
+    dropped_items[list_name] = len(items) - len(kept)
+    logger.info(
+        "Dropped %s of %s items of list %s to stay within its budget, for example %s",
+        dropped_items[list_name],
+        len(items),
+        list_name,
+        [spoken for spoken in items if spoken not in kept][:5],
+    )
+    return kept
+
+
+def govern_update(list_name, added, removed):
+    """Operation applying a delta to a plain list and truncating the list to its
+    budget if the delta made it outgrow it
+
+    Unlike pushes, deltas are governed once they are applied, since only then
+    are the contents they add to known
+    """
+    update = update_items(added, removed)
+
+    def operation(dict_list):
+        update(dict_list)
+        kept = govern_items(list_name, list_name, dict_list)
+        if kept is not dict_list:
+            for spoken in [spoken for spoken in dict_list if spoken not in kept]:
+                del dict_list[spoken]
+
+    return operation
+
+
+def fingerprint_items(data):
+    """Cheap digest of the spoken forms and values of a list push
+
+    Args:
+        data (List[dict]): the items as received from the editor
+
+    Returns:
+        str: hex digest that is equal for pushes with identical contents
+    """
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+@add_method()
+@add_lane_key(list_lane)
+def enhance_spoken(list_name, data, version=None, fingerprint=None, metadata=None):
+    """Replace the contents of a list
+
+    Args:
+        list_name (str): the name of the list to replace, or of one of its
+            layers like ``expression.local``
+        data (List[dict]): the new items, keyed by their spoken form, or the
+            columnar table of them
+        version (int, optional): the version the editor assigns to these contents
+        fingerprint (str, optional): digest of the contents computed by the
+            editor, if not provided one is computed from ``data``
+        metadata (dict, optional): the ``file_uri`` and ``scope`` the contents
+            were computed for, used to cache them for ``restore_spoken``, and the
+            ``project`` they belong to, used to keep a warm start snapshot per project
+
+    Returns:
+        dict: ``sequence`` acknowledges the push, ``version`` is the version of
+        the list after the call, ``skipped`` is True if the contents were
+        identical to the last push and the list was left untouched and
+        ``dropped`` is how many items did not fit in the budget of the list
+    """
+    split_layer(list_name)
+    if fingerprint is None:
+        fingerprint = fingerprint_items(data)
+    strings = {}
+    items = dict(compact_items(data, strings))
     logger.debug(
         "Sample item: %s",
-        data[0] if data else None,
+        next(iter(items.values()), None),
+    )
+    return replace_items(
+        list_name,
+        items,
+        strings,
+        version,
+        fingerprint,
+        metadata,
+    )
+
+
+def replace_items(list_name, items, strings, version, fingerprint, metadata=None):
+    with versions_lock:
+        if version is None:
+            version = versions.get(list_name, 0) + 1
+        versions[list_name] = version
+        if metadata and metadata.get("project"):
+            list_projects[split_layer(list_name)[0]] = metadata["project"]
+        if metadata and metadata.get("file_uri"):
+            snapshots.store(
+                metadata, list_name, (items, strings, version, fingerprint)
+            )
+        if fingerprints.get(list_name) == fingerprint:
+            skipped_pushes[list_name] = skipped_pushes.get(list_name, 0) + 1
+            logger.info(
+                "Skipped unchanged push for list %s with %s items (%s skipped so far)",
+                list_name,
+                len(items),
+                skipped_pushes[list_name],
+            )
+            return {
+                "sequence": None,
+                "version": version,
+                "skipped": True,
+                "dropped": dropped_items.get(list_name, 0),
+            }
+        fingerprints[list_name] = fingerprint
+        string_tables[list_name] = strings
+        sequence = submit_items(list_name, items)
+        dropped = dropped_items[list_name]
+    return {
+        "sequence": sequence,
+        "version": version,
+        "skipped": False,
+        "dropped": dropped,
+    }
+
+
+@add_method()
+@add_lane_key(list_lane)
+def enhance_spoken_delta(list_name, added, removed, version):
+    """Apply an incremental update on top of the current contents of a list
+
+    Args:
+        list_name (str): the name of the list to update
+        added (List[dict]): items to insert or replace, keyed by their spoken
+            form, or the columnar table of them
+        removed (List[str]): spoken forms to remove from the list
+        version (int): the version of the list after applying this delta, it must
+            directly follow the version we currently hold
+
+    Returns:
+        dict: ``resync`` is True if the delta was rejected and the editor should
+        push the full list via ``enhance_spoken``, ``version`` is the version
+        of the list held after the call, ``sequence`` acknowledges the push and
+        ``dropped`` is how many items did not fit in the budget of the list
+        after the last update applied to it, which for a plain list may not
+        include this delta yet
+    """
+    base, layer = split_layer(list_name)
+    with versions_lock:
+        current = versions.get(list_name)
+        if current is None or version != current + 1:
+            # a subscriber cannot answer the editor, the broker has to ask for the resync
+            if notify_broker("request_resync", [list_name]):
+                logger.warning(
+                    "Rejected delta for list %s (version %s on top of %s), "
+                    "asked the broker to have the editor resync it",
+                    list_name,
+                    version,
+                    current,
+                )
+            else:
+                logger.info(
+                    "Rejected delta for list %s (version %s on top of %s), requesting resync",
+                    list_name,
+                    version,
+                    current,
+                )
+            return {"resync": True, "version": current, "sequence": None}
+        versions[list_name] = version
+        fingerprints.pop(list_name, None)
+        items = compact_items(added, string_tables.setdefault(list_name, {}))
+        if layer is None:
+            sequence = scheduler.submit(list_name, govern_update(list_name, items, removed))
+        else:
+            updated = dict(layers.get(base, {}).get(layer, {}))
+            for spoken in removed:
+                updated.pop(spoken, None)
+            updated.update(items)
+            sequence = submit_items(list_name, updated)
+    logger.debug(
+        "Queued delta for list %s with %s added and %s removed items",
+        list_name,
+        len(items),
+        len(removed),
+    )
+    return {
+        "resync": False,
+        "version": version,
+        "sequence": sequence,
+        "dropped": dropped_items.get(list_name, 0),
+    }
+
+
+@add_method()
+@add_lane_key(list_lane)
+def request_resync(list_name):
+    """Forget the version of a list, so that the next delta the editor sends
+    for it is rejected and the editor pushes the full list again
+
+    Called by the processes subscribed to this one through the broker (see
+    ``rpc.BrokerSubscription``) when they had to reject a delta, since only
+    the broker can answer the editor
+    """
+    with versions_lock:
+        versions.pop(list_name, None)
+    logger.info("A subscriber asked for a resync of list %s", list_name)
+
+
+############################## CHUNKED UPLOADS ##############################
+#
+# very large lists can be transferred as a sequence of smaller messages, so
+# that each chunk is decoded and staged as it arrives, instead of holding the
+# whole payload and its parsed form in memory at once
+#
+##############################################################################
+
+# chunked uploads are identified by this prefix followed by the name of the list
+# and the nonce the editor picked for the upload, separated by a colon
+UPLOAD_ID_PREFIX = "upload:"
+
+
+def upload_list_name(upload_id):
+    return upload_id[len(UPLOAD_ID_PREFIX) :].partition(":")[0]
+
+
+def upload_lane(upload_id, *args, **kwargs):
+    """The chunks of an upload stay in order with the other requests for its list"""
+    return list_lane(upload_list_name(upload_id))
+
+
+def staged_upload(upload_id):
+    """The upload with the given id, still being received
+
+    Raises:
+        ValueError: if a newer upload for the same list has been started since
+        KeyError: if there is no such upload
+    """
+    upload = uploads.get(upload_list_name(upload_id))
+    if upload is not None and upload["id"] != upload_id:
+        raise ValueError(
+            "Upload {} was superseded by upload {}".format(upload_id, upload["id"])
+        )
+    if upload is None:
+        raise KeyError(upload_id)
+    return upload
+
+
+@add_method()
+@add_lane_key(list_lane)
+def begin_list(list_name, nonce, version=None, fingerprint=None, metadata=None):
+    """Start a chunked replacement of the contents of a list
+
+    Only the latest upload for a list is kept, an upload that was never
+    committed is discarded and any chunks still sent for it are rejected. The
+    upload id is derived from the list name and the nonce picked by the editor,
+    so that processes receiving the same messages through a broker agree on it,
+    while concurrent uploads of the same list from two editors do not mix.
+
+    Args:
+        list_name (str): the name of the list to replace
+        nonce (str): picked by the editor, unique among its uploads of the list
+        version (int, optional): the version the editor assigns to these contents
+        fingerprint (str, optional): digest of the contents computed by the
+            editor, if not provided one is computed from the received chunks
+        metadata (dict, optional): same as ``enhance_spoken``
+
+    Returns:
+        str: the id of the upload to pass to ``append_list_chunk`` and ``commit_list``
+    """
+    split_layer(list_name)
+    upload_id = "{}{}:{}".format(UPLOAD_ID_PREFIX, list_name, nonce)
+    with versions_lock:
+        if list_name in uploads:
+            logger.info(
+                "Discarding unfinished upload %s for list %s",
+                uploads[list_name]["id"],
+                list_name,
+            )
+        uploads[list_name] = {
+            "id": upload_id,
+            "list_name": list_name,
+            "version": version,
+            "fingerprint": fingerprint,
+            "metadata": metadata,
+            "hash": hashlib.sha1() if fingerprint is None else None,
+            "items": {},
+            "strings": {},
+        }
+    return upload_id
+
+
+@add_method()
+@add_lane_key(upload_lane)
+def append_list_chunk(upload_id, data):
+    """Stage a chunk of items of an upload started with ``begin_list``
+
+    Returns:
+        int: the number of items staged so far
+    """
+    upload = staged_upload(upload_id)
+    if upload["hash"] is not None:
+        encoded = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        upload["hash"].update(encoded.encode("utf-8"))
+    upload["items"].update(compact_items(data, upload["strings"]))
+    return len(upload["items"])
+
+
+@add_method()
+@add_lane_key(upload_lane)
+def commit_list(upload_id):
+    """Atomically swap in the items staged for an upload
+
+    Returns:
+        dict: same as ``enhance_spoken``
+    """
+    with versions_lock:
+        upload = uploads.pop(staged_upload(upload_id)["list_name"])
+    fingerprint = upload["fingerprint"]
+    if fingerprint is None:
+        fingerprint = "chunked:" + upload["hash"].hexdigest()
+    return replace_items(
+        upload["list_name"],
+        upload["items"],
+        upload["strings"],
+        upload["version"],
+        fingerprint,
+        upload["metadata"],
+    )
+
+
+############################## SNAPSHOT CACHE ##############################
+#
+# editors may tag the lists they push with the file and scope they were computed
+# for, so that when the user returns to a recently visited scope, the lists can
+# be swapped in right away while the fresh push is still on its way
+#
+#############################################################################
+
+
+class SnapshotCache(object):
+    """Least recently used cache of list contents keyed by (file_uri, scope)
+
+    Entries are evicted once there are more than ``max_entries`` of them or they
+    hold more than ``max_items`` items in total.
+    """
+
+    def __init__(self, max_entries, max_items):
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.items = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(metadata):
+        return (metadata.get("file_uri"), metadata.get("scope"))
+
+    def store(self, metadata, list_name, snapshot):
+        key = self.key(metadata)
+        with self.lock:
+            entry = self.entries.pop(key, {})
+            if list_name in entry:
+                self.items -= len(entry[list_name][0])
+            entry[list_name] = snapshot
+            self.items += len(snapshot[0])
+            self.entries[key] = entry
+            while self.entries and (
+                len(self.entries) > self.max_entries or self.items > self.max_items
+            ):
+                _, evicted = self.entries.popitem(last=False)
+                self.items -= sum(len(s[0]) for s in evicted.values())
+
+    def get(self, metadata):
+        key = self.key(metadata)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+
+# protect against reloads
+try:
+    snapshots
+except NameError:
+    snapshots = SnapshotCache(SNAPSHOT_CACHE_SIZE, SNAPSHOT_CACHE_MAX_ITEMS)
+else:
+    snapshots.max_entries = SNAPSHOT_CACHE_SIZE
+    snapshots.max_items = SNAPSHOT_CACHE_MAX_ITEMS
+
+
+@add_method()
+def restore_spoken(file_uri, scope=None):
+    """Swap in the lists last pushed for the given file and scope, if cached
+
+    Returns:
+        dict: for each restored list, the same result as ``enhance_spoken``,
+        empty if nothing was cached
+    """
+    metadata = {"file_uri": file_uri, "scope": scope}
+    entry = snapshots.get(metadata)
+    if entry is None:
+        logger.debug("No cached lists for %s %s", file_uri, scope)
+        return {}
+    results = {}
+    for list_name, (items, strings, version, fingerprint) in entry.items():
+        results[list_name] = replace_items(list_name, items, strings, version, fingerprint)
+    logger.info("Restored cached lists %s for %s %s", list(results), file_uri, scope)
+    return results
+
+
+############################## WARM START ##############################
+#
+# the contents of every list are marshalled to WARM_START_DIR in the background
+# after pushes are applied, one file per project and list, and the newest file
+# of a list is loaded when it is created, so that the grammar is usable right
+# away after a restart. The next push from the editor replaces them
+#
+########################################################################
+
+
+def warm_start_path(list_name, project=None):
+    directory = os.path.expanduser(WARM_START_DIR.format(service=WARM_START_SERVICE))
+    if project is None:
+        key = "default"
+    else:
+        key = hashlib.sha1(project.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, key, list_name + ".marshal")
+
+
+class WarmStartWriter(object):
+    """Saves the contents of the lists from a background thread
+
+    Only the latest contents of each list are kept while waiting, so bursts of
+    pushes result in a single write.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def schedule(self, list_name, items):
+        path = warm_start_path(list_name, list_projects.get(list_name))
+        with self.condition:
+            self.pending[path] = (list_name, items)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                pending, self.pending = self.pending, {}
+            for path, (list_name, items) in pending.items():
+                try:
+                    self.write(path, list_name, items)
+                except Exception:
+                    logger.exception("Failed to save list %s to %s", list_name, path)
+            time.sleep(self.interval)
+
+    @staticmethod
+    def write(path, list_name, items):
+        start = time.time()
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "wb") as f:
+            # plain dicts of json values only, loading them executes no code
+            marshal.dump([dict(item) for item in items], f)
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(temporary, path)
+        logger.debug(
+            "Saved %s items of list %s in %s seconds",
+            len(items),
+            list_name,
+            time.time() - start,
+        )
+
+
+# protect against reloads
+try:
+    warm_start_writer
+except NameError:
+    warm_start_writer = WarmStartWriter(WARM_START_WRITE_INTERVAL_SECONDS)
+else:
+    warm_start_writer.interval = WARM_START_WRITE_INTERVAL_SECONDS
+
+
+def restore_warm_start(list_name):
+    """Fill a newly created list with the newest snapshot saved for it, if any"""
+    if WARM_START_DIR is None:
+        return
+    directory = os.path.expanduser(WARM_START_DIR.format(service=WARM_START_SERVICE))
+    candidates = []
+    if os.path.isdir(directory):
+        for project in os.listdir(directory):
+            path = os.path.join(directory, project, list_name + ".marshal")
+            if os.path.isfile(path):
+                candidates.append((os.path.getmtime(path), path))
+    if not candidates:
+        return
+    _, path = max(candidates)
+    start = time.time()
+    try:
+        with open(path, "rb") as f:
+            data = marshal.load(f)
+    except Exception:
+        logger.exception("Failed to load the saved contents of list %s", list_name)
+        return
+    strings = {}
+    items = dict(compact_items(data, strings))
+    dict_list = lists[list_name]
+    with dict_list:
+        dict_list.set(items)
+    string_tables[list_name] = strings
+    restored.add(list_name)
+    notify_listeners(list_name, dict_list)
+    logger.info(
+        "Restored %s items of list %s from %s in %s seconds",
+        len(items),
+        list_name,
+        path,
+        time.time() - start,
     )
-    return True
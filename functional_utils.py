@@ -1,4 +1,5 @@
 import inspect
+import weakref
 
 import six
 
@@ -33,14 +34,44 @@ def get_signature_arguments(function):
     return valid_keywords, filter_keywords
 
 
-def get_only_proper_arguments(function, data):
+# argument extractors of the functions evaluated so far, dropped along with the functions
+compiled_extractors = weakref.WeakKeyDictionary()
+
+
+def compile_argument_extractor(function):
+    """Build a callable picking the arguments of the function out of the data
+
+    The signature is only analyzed the first time a function is seen, and the
+    extractor only reads the keys the function accepts, without copying the data
+
+    Args:
+        function (Callable): the function in question
+
+    Returns:
+        Callable[[dict],dict]: extracts the keyword arguments from the data
+    """
+    try:
+        return compiled_extractors[function]
+    except (KeyError, TypeError):
+        pass
     valid_keywords, filter_keywords = get_signature_arguments(function)
-    arguments = data.copy()
     if filter_keywords:
-        invalid_keywords = set(arguments.keys()) - valid_keywords
-        for key in invalid_keywords:
-            del arguments[key]
-    return arguments
+        keywords = tuple(valid_keywords)
+
+        def extractor(data):
+            return {k: data[k] for k in keywords if k in data}
+
+    else:
+
+        def extractor(data):
+            return data
+
+    try:
+        compiled_extractors[function] = extractor
+    except TypeError:
+        # not weak referenceable, analyze it again next time
+        pass
+    return extractor
 
 
 def rename_data(data, remap_data):
@@ -61,8 +92,9 @@ def rename_data(data, remap_data):
 
 
 def evaluate_function(function, data={}, remap_data={}):
-    renamed = rename_data(data, remap_data)
-    arguments = get_only_proper_arguments(function, renamed)
+    if remap_data or not isinstance(data, dict):
+        data = rename_data(data, remap_data)
+    arguments = compile_argument_extractor(function)(data)
     try:
         return function(**arguments)
     except Exception as e:
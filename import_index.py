@@ -0,0 +1,150 @@
+import bisect
+import logging
+import time
+
+try:
+    from pyvoice_caster.dict_lists import add_list_listener
+except ImportError:
+    from caster_user_content.rules.pyvoice_caster.dict_lists import add_list_listener
+
+__all__ = [
+    "resolve_import",
+]
+
+# lists whose items can be imported from the module they belong to
+INDEXED_LISTS = ("importable", "subsymbol")
+
+# prefix index over the current contents of each of the INDEXED_LISTS,
+# protected against reloads
+try:
+    indexes
+except NameError:
+    indexes = {}
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def normalize(spoken):
+    return " ".join(spoken.lower().split())
+
+
+def qualified_name(item):
+    return ".".join(part for part in (item.get("module"), item.get("name")) if part)
+
+
+class PrefixIndex(object):
+    """Spoken forms of the items of a list, grouped by the module the items
+    belong to and kept sorted, so that all forms starting with a prefix form a
+    contiguous range that is found with a binary search
+
+    Updates only regroup the modules whose items changed, found by comparing
+    the items of the list with those seen on the previous update
+    """
+
+    def __init__(self):
+        self.contents = {}
+        self.groups = {}
+
+    def update(self, dict_list):
+        contents = dict(dict_list)
+        previous = self.contents
+        changed = set()
+        still_present = 0
+        for spoken, item in contents.items():
+            old = previous.get(spoken)
+            if old is item:
+                still_present += 1
+                continue
+            if old is not None:
+                still_present += 1
+                changed.add(old.get("module"))
+            changed.add(item.get("module"))
+        if still_present < len(previous):
+            for spoken, old in previous.items():
+                if spoken not in contents:
+                    changed.add(old.get("module"))
+        changed.discard(None)
+        self.contents = contents
+        if not changed:
+            return 0
+        groups = dict((module, []) for module in changed)
+        for spoken, item in contents.items():
+            entries = groups.get(item.get("module"))
+            if entries is not None:
+                entries.append((normalize(spoken), item))
+        for module, entries in groups.items():
+            if not entries:
+                self.groups.pop(module, None)
+                continue
+            entries.sort(key=lambda entry: entry[0])
+            self.groups[module] = (
+                [entry[0] for entry in entries],
+                [entry[1] for entry in entries],
+            )
+        return len(changed)
+
+    def candidates(self, module, prefix):
+        """Returns the (spoken, item) pairs of module whose spoken form starts with prefix"""
+        keys, items = self.groups.get(module, ((), ()))
+        start = end = bisect.bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return zip(keys[start:end], items[start:end])
+
+
+def rebuild_index(list_name, dict_list):
+    start = time.time()
+    index = indexes.get(list_name)
+    if index is None:
+        index = indexes[list_name] = PrefixIndex()
+    regrouped = index.update(dict_list)
+    logger.debug(
+        "Indexed %s items of list %s in %s seconds, regrouping %s modules",
+        len(dict_list),
+        list_name,
+        time.time() - start,
+        regrouped,
+    )
+
+
+for list_name in INDEXED_LISTS:
+    add_list_listener(list_name, rebuild_index)
+
+
+def resolve_import(importable, name):
+    """Find the item of ``importable`` the user most likely meant by ``name``
+
+    An exact match on the spoken form is preferred over a prefix match, but
+    either is only accepted if it points to a single symbol.
+
+    Args:
+        importable (dict): the module selected from the importable list
+        name (str): the free dictation naming the symbol to import
+
+    Returns:
+        dict: the item to pass to ``add_import``, or None if there is no match
+        or it is ambiguous and should be left to the language server
+    """
+    prefix = normalize(name)
+    if not prefix:
+        return None
+    module = qualified_name(importable)
+    exact = []
+    partial = []
+    for list_name in INDEXED_LISTS:
+        index = indexes.get(list_name)
+        if index is None:
+            continue
+        for spoken, item in index.candidates(module, prefix):
+            (exact if spoken == prefix else partial).append(item)
+    matches = exact or partial
+    if len(set(qualified_name(item) for item in matches)) == 1:
+        return matches[0]
+    logger.debug(
+        "No unique local match for %r in %s among %s candidates",
+        name,
+        module,
+        len(matches),
+    )
+    return None
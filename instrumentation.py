@@ -0,0 +1,135 @@
+import math
+import time
+
+__all__ = [
+    "get_stats",
+    "record",
+    "timed",
+]
+
+# Set to False to skip recording timings altogether
+STATS_ENABLED = True
+
+# Timings are counted in buckets whose bounds grow geometrically by
+# BUCKET_GROWTH, starting from BUCKET_MIN_SECONDS, so that percentiles are
+# known within about 20% whatever their magnitude
+BUCKET_MIN_SECONDS = 1e-6
+BUCKET_GROWTH = 2 ** 0.25
+BUCKET_COUNT = 112
+
+clock = getattr(time, "perf_counter", time.time)
+
+# histograms by stage name, like rpc.decode or list.set.expression, protected
+# against reloads
+try:
+    histograms
+except NameError:
+    histograms = {}
+
+
+class Histogram(object):
+    """Counts of timings in logarithmic buckets
+
+    Recording takes no lock, concurrent writers on the same histogram may
+    rarely lose a count, which is acceptable for statistics and keeps the
+    cost of recording to a few increments
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= BUCKET_MIN_SECONDS:
+            index = 0
+        else:
+            index = int(math.log(seconds / BUCKET_MIN_SECONDS, BUCKET_GROWTH)) + 1
+            index = min(index, BUCKET_COUNT - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of timings, in seconds"""
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(BUCKET_MIN_SECONDS * BUCKET_GROWTH ** index, self.max)
+        return self.max
+
+    def summary(self):
+        """Returns the count and the mean, p50, p90, p99 and max in milliseconds"""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": 1000 * self.total / self.count,
+            "p50": 1000 * self.percentile(0.5),
+            "p90": 1000 * self.percentile(0.9),
+            "p99": 1000 * self.percentile(0.99),
+            "max": 1000 * self.max,
+        }
+
+
+def record(name, seconds):
+    if STATS_ENABLED:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms.setdefault(name, Histogram())
+        histogram.record(seconds)
+
+
+class timed(object):
+    """Context manager recording how long its body took under ``name``"""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, clock() - self.start)
+        return False
+
+
+def get_stats(reset=False):
+    """Summaries of all recorded timings
+
+    Args:
+        reset (bool): start counting anew after reading them
+
+    Returns:
+        dict: the summary of each histogram by stage name, see ``Histogram.summary``
+    """
+    stats = {}
+    for name, histogram in sorted(histograms.items()):
+        stats[name] = histogram.summary()
+        if reset:
+            histogram.reset()
+    return stats
+
+
+def format_stats(stats):
+    lines = []
+    for name, summary in sorted(stats.items()):
+        if not summary["count"]:
+            continue
+        lines.append(
+            "{}: {} calls, p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+                name, summary["count"], summary["p50"], summary["p99"], summary["max"]
+            )
+        )
+    return "\n".join(lines)
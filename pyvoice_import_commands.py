@@ -5,12 +5,18 @@ try:
                                                VSCodeCommand)
     from pyvoice_caster.caster_standard_imports import *
     from pyvoice_caster.dict_lists import dynamic_list, dynamic_list_reference
+    from pyvoice_caster.import_index import resolve_import
+    from pyvoice_caster.instrumentation import format_stats, get_stats
 except ImportError:
     from caster_user_content.rules.pyvoice_caster.action_classes import (
         LspExecute, SublimeCommand, VSCodeCommand)
     from caster_user_content.rules.pyvoice_caster.caster_standard_imports import *
     from caster_user_content.rules.pyvoice_caster.dict_lists import (
         dynamic_list, dynamic_list_reference)
+    from caster_user_content.rules.pyvoice_caster.import_index import \
+        resolve_import
+    from caster_user_content.rules.pyvoice_caster.instrumentation import (
+        format_stats, get_stats)
 
 
 def insert_pyvoice_qualified(importable):
@@ -18,6 +24,20 @@ def insert_pyvoice_qualified(importable):
     Text('"{}"'.format(t)).execute()
 
 
+def from_import_fuzzy(importable, every, name):
+    item = None if every else resolve_import(importable, str(name))
+    if item is not None:
+        LspExecute("add_import", ["$file_uri", item]).execute()
+    else:
+        LspExecute(
+            "from_import_fuzzy", ["$file_uri", importable, str(name), every]
+        ).execute()
+
+
+def print_stats():
+    print(format_stats(get_stats()) or "No timings recorded yet")
+
+
 class PyvoiceImport(MappingRule):
     pronunciation = "pie voice import"
 
@@ -41,15 +61,7 @@ class PyvoiceImport(MappingRule):
             rdescript="Deeper From import statement part two",
         ),
         "from  <importable> [fuzzy] import  [<every>] [<name>]": R(
-            LspExecute(
-                "from_import_fuzzy",
-                lambda importable, every, name: [
-                    "$file_uri",
-                    importable,
-                    str(name),
-                    every,
-                ],
-            ),
+            Function(from_import_fuzzy),
             rdescript="From ",
         ),
         "get spoken": R(
@@ -57,6 +69,10 @@ class PyvoiceImport(MappingRule):
             rdescript="Shorthand for getting spoken information without waiting for the listener on the editor",
         ),
         "qualified <importable>": R(Function(insert_pyvoice_qualified)),
+        "show latency stats": R(
+            Function(print_stats),
+            rdescript="Print p50/p99 timings of the rpc server, list updates and editor commands",
+        ),
     }
     extras = [
         dynamic_list_reference("importable"),
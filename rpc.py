@@ -1,27 +1,84 @@
 import base64
+import hmac
 import json
 import logging
+import operator
 import os
+import random
+import struct
 import sys
 import threading
-from multiprocessing import AuthenticationError
+import time
+import weakref
+from multiprocessing import AuthenticationError, Pipe
 from multiprocessing.connection import Client, Listener
 
+
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "deps.zip"))
 
 from jsonrpc.dispatcher import Dispatcher
+from jsonrpc.exceptions import (JSONRPCError, JSONRPCInvalidRequest,
+                                JSONRPCInvalidRequestException,
+                                JSONRPCParseError)
+from jsonrpc.jsonrpc import JSONRPCRequest
+from jsonrpc.jsonrpc2 import JSONRPC20Response
 from jsonrpc.manager import JSONRPCResponseManager
 
 try: # python 2
     from SocketServer import BaseRequestHandler, BaseServer, ThreadingMixIn
+    from Queue import Full, Queue
 except ImportError: # python 3
     from socketserver import BaseRequestHandler, BaseServer, ThreadingMixIn
+    from queue import Full, Queue
+
+try:
+    from multiprocessing.connection import wait
+except ImportError: # python 2
+    wait = None
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError: # python 2
+    asyncio = None
 
-__all__ = ["add_method"]
+try:
+    from pyvoice_caster.instrumentation import get_stats, timed
+except ImportError:
+    from caster_user_content.rules.pyvoice_caster.instrumentation import (
+        get_stats, timed)
+
+__all__ = ["add_lane_key", "add_method", "notify_broker"]
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Which server implementation to use, "threading" spawns a thread per connection,
+# "pooled" multiplexes all connections over a bounded set of workers and "asyncio"
+# serves all connections from a single event loop (unix sockets only)
+SERVER_ENGINE = "threading"
+
+# Number of worker threads of the pooled engine
+POOL_WORKERS = 4
+
+# How many requests each worker of the pooled engine may hold queued before the
+# server answers with SERVER_BUSY_CODE
+POOL_QUEUE_SIZE = 64
+
+SERVER_BUSY_CODE = -32001
+
+# Whether a process finding the socket of a service already served by another
+# recognizer process subscribes to it, instead of taking the socket over
+ENABLE_BROKER = True
+
+# methods handled by the transport itself and never fanned out to subscribers
+INTERNAL_METHOD_PREFIX = "voicerpc."
+SUBSCRIBE_METHOD = "voicerpc.subscribe"
+
+# Path template, formatted with the service name, of a file every message received
+# by the server is recorded in for later replay, eg "~/.voicerpc/{service}.rec".
+# None disables recording
+RECORD_TRAFFIC_FILE = None
 
 
 class MultiProcessingSever(BaseServer):
@@ -68,22 +125,217 @@ class MultiProcessingSever(BaseServer):
         request.close()
 
 
+############################## WIRE FORMATS ##############################
+#
+# besides plain JSON-RPC messages, clients may send messages in a compact
+# columnar encoding, where a list of objects sharing the same keys is sent as
+#
+#       {"$columns": ["spoken", "value"], "$rows": [["foo", "foo()"], ...]}
+#
+# and prefixed with COLUMNAR_MARKER. The tables are passed to the methods as
+# they arrive, so only lists of list items may be sent this way, which the
+# methods of dict_lists turn into items straight from the rows. Both formats
+# are accepted on every connection, each message is decoded according to its
+# marker. Clients find out whether the server accepts the columnar one by
+# calling NEGOTIATE_METHOD with the formats they can emit
+#
+###########################################################################
+
+NEGOTIATE_METHOD = "voicerpc.negotiate"
+
+# formats supported by this server, in order of preference
+WIRE_FORMATS = ["columnar", "json"]
+
+COLUMNAR_MARKER = b"\x01"
+
+
+def negotiate(formats):
+    """Pick the wire format a client should send its messages in
+
+    Nothing is recorded for the connection, the server keeps accepting every
+    format it supports, the answer only tells the client which one it prefers
+
+    Args:
+        formats (List[str]): the formats the client is able to emit
+
+    Returns:
+        str: the preferred format supported by both ends
+    """
+    for wire_format in WIRE_FORMATS:
+        if wire_format in formats:
+            return wire_format
+    return "json"
+
+
+# set like view of the keys of a dict, compared regardless of their order
+dict_keys = getattr(dict, "viewkeys", dict.keys)
+
+
+def is_table(obj):
+    return isinstance(obj, dict) and "$columns" in obj and "$rows" in obj
+
+
+def expand_columns(obj):
+    """The list of objects a columnar table stands for, other values unchanged"""
+    if is_table(obj):
+        columns = obj["$columns"]
+        return [dict(zip(columns, row)) for row in obj["$rows"]]
+    return obj
+
+
+def collapse_columns(obj):
+    """Convert every list of objects sharing the same keys into a columnar table,
+    the values in the rows are kept as they are"""
+    if isinstance(obj, dict):
+        return {k: collapse_columns(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        if obj and isinstance(obj[0], dict):
+            keys = dict_keys(obj[0])
+            if all(isinstance(x, dict) and dict_keys(x) == keys for x in obj):
+                columns = list(obj[0])
+                row = operator.itemgetter(*columns)
+                if len(columns) == 1:
+                    rows = [[row(x)] for x in obj]
+                else:
+                    rows = [row(x) for x in obj]
+                return {"$columns": columns, "$rows": rows}
+        return [collapse_columns(x) for x in obj]
+    return obj
+
+
+def encode_message(payload, wire_format="json"):
+    """Encode a JSON-RPC payload in the given wire format"""
+    if wire_format == "columnar":
+        encoded = json.dumps(collapse_columns(payload), separators=(",", ":"))
+        return COLUMNAR_MARKER + encoded.encode("utf-8")
+    return json.dumps(payload).encode("utf-8")
+
+
+def decode_message(data):
+    """Decode a message received on the wire, in any of the supported formats,
+    leaving columnar tables as they are"""
+    if data[:1] == COLUMNAR_MARKER:
+        return json.loads(data[1:].decode("utf-8"))
+    return json.loads(data.decode("utf-8"))
+
+
+def parse_message(data):
+    """Decode a message into a JSON-RPC request
+
+    Returns:
+        Tuple[JSONRPCRequest,JSONRPC20Response]: the request or, if the message
+        is malformed, the error response to send back
+    """
+    try:
+        payload = decode_message(data)
+    except (TypeError, ValueError):
+        return None, JSONRPC20Response(error=JSONRPCParseError()._data)
+    try:
+        return JSONRPCRequest.from_data(payload), None
+    except JSONRPCInvalidRequestException:
+        return None, JSONRPC20Response(error=JSONRPCInvalidRequest()._data)
+
+
+def locked_sender(connection):
+    lock = threading.Lock()
+
+    def send(data):
+        with lock:
+            connection.send_bytes(data)
+
+    return send
+
+
+############################## TRAFFIC RECORDING ##############################
+#
+# recordings start with RECORDING_MAGIC followed by one record per message
+#
+#       timestamp (double) | connection id (uint32) | length (uint32) | message
+#
+# little endian, where connection ids are numbered in order of first message
+#
+################################################################################
+
+RECORDING_MAGIC = b"VRPCREC1"
+RECORD_HEADER = struct.Struct("<dII")
+
+
+class TrafficRecorder(object):
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.file = open(self.path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(RECORDING_MAGIC)
+        self.lock = threading.Lock()
+        self.connections = weakref.WeakKeyDictionary()
+        self.last_connection_id = 0
+
+    def connection_id(self, sender):
+        if sender is None:
+            return 0
+        connection_id = self.connections.get(sender)
+        if connection_id is None:
+            self.last_connection_id += 1
+            connection_id = self.connections[sender] = self.last_connection_id
+        return connection_id
+
+    def write(self, data, sender=None):
+        with self.lock:
+            header = RECORD_HEADER.pack(time.time(), self.connection_id(sender), len(data))
+            self.file.write(header + data)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_recording(path):
+    """Iterate over the messages of a recording made by TrafficRecorder
+
+    Yields:
+        Tuple[float,int,bytes]: the timestamp, connection id and raw message
+    """
+    with open(os.path.expanduser(path), "rb") as f:
+        if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError("{} is not a voicerpc recording".format(path))
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, connection_id, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                # truncated by a crash while recording
+                return
+            yield timestamp, connection_id, data
+
+
 class JsonRpcRequestHandler(BaseRequestHandler):
+    def setup(self):
+        self.send = locked_sender(self.request)
+
     def handle(self):
         logger.debug("client %s connected", self.request)
         while True:
             try:
-                data = self.request.recv_bytes()
+                # wait for the message to arrive, so that only its transfer is timed
+                self.request.poll(None)
+                with timed("rpc.receive"):
+                    data = self.request.recv_bytes()
             except EOFError:
                 logger.debug("client %s disconnected ", self.request)
                 break
-            response = JSONRPCResponseManager.handle(data, self.server.dispatcher)
+            response = self.server.handle_message(data, self.send)
             if response:
-                self.request.send_bytes(response.json.encode())
+                self.send(response.json.encode())
 
+    def finish(self):
+        self.server.unsubscribe(self.send)
 
-class RPCServer(ThreadingMixIn, MultiProcessingSever):
-    daemon_threads = True
+
+class DispatcherMixin(object):
+    recorder = None
 
     @property
     def dispatcher(self):
@@ -91,11 +343,423 @@ class RPCServer(ThreadingMixIn, MultiProcessingSever):
             self._dispatcher = Dispatcher()
         return self._dispatcher
 
+    @property
+    def lane_keys(self):
+        if not hasattr(self, "_lane_keys"):
+            self._lane_keys = {}
+        return self._lane_keys
+
+    @property
+    def subscribers(self):
+        if not hasattr(self, "_subscribers"):
+            self._subscribers = set()
+        return self._subscribers
+
     def add_method(self, method, name=None):
         return self.dispatcher.add_method(method, name)
 
     def remove_method(self, name):
         self.dispatcher.pop(name, None)
+        self.lane_keys.pop(name, None)
+
+    def add_lane_key(self, name, key):
+        """Serialize the requests of a method by the lane ``key`` picks for them
+
+        Args:
+            name (str): the name of the method
+            key (Callable): called with the params of each request, returns the
+                lane to execute the request in, or None if it needs none
+        """
+        self.lane_keys[name] = key
+
+    def lane_key(self, request):
+        """The lane of a request as picked by the key registered for its method,
+        None for batches and methods without a key"""
+        key = self.lane_keys.get(getattr(request, "method", None))
+        if key is None:
+            return None
+        try:
+            return key(*request.args, **request.kwargs)
+        except (TypeError, KeyError, IndexError, AttributeError):
+            # malformed params, the dispatcher reports them
+            return None
+
+    def handle_message(self, data, sender=None):
+        """Handle a message received from a client
+
+        Args:
+            data (bytes): the raw message
+            sender (Callable[[bytes],None], optional): sends data back to the
+                client, also identifies its connection
+
+        Returns:
+            JSONRPC20Response: the response to send back, if any
+        """
+        if self.recorder is not None:
+            self.recorder.write(data, sender)
+        with timed("rpc.decode"):
+            request, error = parse_message(data)
+        if error is not None:
+            return error
+        method = getattr(request, "method", None)
+        if method not in self.dispatcher:
+            method = "unknown"
+        with timed("rpc.dispatch." + method):
+            return self.dispatch_request(request, data, sender)
+
+    def dispatch_request(self, request, data, sender=None):
+        method = getattr(request, "method", None) or ""
+        if method == SUBSCRIBE_METHOD and sender is not None:
+            logger.info("Process subscribed to %s", self.server_address)
+            self.subscribers.add(sender)
+            return JSONRPC20Response(_id=request._id, result=True)
+        # messages from subscribers are meant for the broker alone
+        if (
+            self.subscribers
+            and sender not in self.subscribers
+            and not method.startswith(INTERNAL_METHOD_PREFIX)
+        ):
+            self.broadcast(data, sender)
+        return JSONRPCResponseManager.handle_request(request, self.dispatcher)
+
+    def broadcast(self, data, origin=None):
+        """Forward a raw message to every subscribed process, other than its origin"""
+        for subscriber in list(self.subscribers):
+            if subscriber is origin:
+                continue
+            try:
+                subscriber(data)
+            except (EOFError, IOError, ValueError):
+                self.unsubscribe(subscriber)
+
+    def unsubscribe(self, sender):
+        self.subscribers.discard(sender)
+
+
+class RPCServer(ThreadingMixIn, DispatcherMixin, MultiProcessingSever):
+    daemon_threads = True
+
+
+class PooledRPCServer(RPCServer):
+    """Serves every connection from a single reader thread and executes the
+    requests on a fixed number of workers, each fed by a bounded queue.
+
+    Requests of methods with a lane key (see ``add_lane_key``) that land in the
+    same lane, for instance every request for the same list, are executed on
+    the same worker and in order. The remaining requests of a connection are
+    executed in order among themselves, but not relative to its requests in
+    lanes. When the queue of a worker is full, the request is rejected with a
+    "busy" error. Responses are sent under a lock per connection, so a slow
+    client only holds up its own responses.
+    """
+
+    def __init__(
+        self,
+        server_address,
+        RequestHandlerClass,
+        authkey=None,
+        workers=None,
+        queue_size=None,
+    ):
+        RPCServer.__init__(self, server_address, RequestHandlerClass, authkey)
+        if workers is None:
+            workers = POOL_WORKERS
+        if queue_size is None:
+            queue_size = POOL_QUEUE_SIZE
+        self._connections = []
+        self._senders = {}
+        self._incoming = []
+        self._incoming_lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = Pipe(duplex=False)
+        self._queues = [Queue(queue_size) for _ in range(workers)]
+        self._reader = None
+
+    def server_activate(self):
+        RPCServer.server_activate(self)
+        for queue in self._queues:
+            t = threading.Thread(target=self._work, args=(queue,))
+            t.daemon = True
+            t.start()
+        self._reader = threading.Thread(target=self._read)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def process_request(self, request, client_address):
+        logger.debug("client %s connected", request)
+        self._senders[request] = locked_sender(request)
+        with self._incoming_lock:
+            self._incoming.append(request)
+        self._wakeup_writer.send_bytes(b"")
+
+    def _read(self):
+        while True:
+            with self._incoming_lock:
+                self._connections.extend(self._incoming)
+                del self._incoming[:]
+            for conn in wait(self._connections + [self._wakeup_reader]):
+                if conn is self._wakeup_reader:
+                    conn.recv_bytes()
+                    continue
+                try:
+                    data = conn.recv_bytes()
+                except (EOFError, IOError):
+                    logger.debug("client %s disconnected ", conn)
+                    self._connections.remove(conn)
+                    self.unsubscribe(self._senders.pop(conn))
+                    self.close_request(conn)
+                    continue
+                self._submit(conn, data)
+
+    def _submit(self, conn, data):
+        sender = self._senders[conn]
+        if self.recorder is not None:
+            self.recorder.write(data, sender)
+        with timed("rpc.decode"):
+            request, error = parse_message(data)
+        if error is not None:
+            self._send(sender, error)
+            return
+        key = self.lane_key(request)
+        if key is None:
+            key = id(conn)
+        queue = self._queues[hash(key) % len(self._queues)]
+        try:
+            queue.put_nowait((sender, request, data))
+        except Full:
+            logger.warning(
+                "Server busy, rejecting request %s", getattr(request, "method", "batch")
+            )
+            if not getattr(request, "is_notification", False):
+                busy = JSONRPCError(code=SERVER_BUSY_CODE, message="Server busy")
+                self._send(
+                    sender,
+                    JSONRPC20Response(_id=getattr(request, "_id", None), error=busy._data),
+                )
+
+    def _work(self, queue):
+        while True:
+            sender, request, data = queue.get()
+            method = getattr(request, "method", None)
+            if method not in self.dispatcher:
+                method = "unknown"
+            try:
+                with timed("rpc.dispatch." + method):
+                    response = self.dispatch_request(request, data, sender)
+            except Exception:
+                logger.exception("Failed to handle request %s", request)
+                continue
+            if response:
+                self._send(sender, response)
+
+    def _send(self, sender, response):
+        try:
+            sender(response.json.encode())
+        except (EOFError, IOError, ValueError):
+            logger.debug("client went away before receiving a response")
+
+
+############################## ASYNCIO ENGINE ##############################
+#
+# reimplements the framing and the authentication handshake of the stdlib
+# multiprocessing.connection on top of asyncio, so editors keep connecting
+# with a plain multiprocessing.connection.Client
+#
+#############################################################################
+
+CHALLENGE = b"#CHALLENGE#"
+WELCOME = b"#WELCOME#"
+FAILURE = b"#FAILURE#"
+
+# size of the handshake messages, larger ones are rejected as in the stdlib
+MAX_HANDSHAKE_MESSAGE = 256
+
+# lengths of legacy challenges and responses, and the digests that may prefix
+# the messages of newer pythons, as in the stdlib
+LEGACY_HANDSHAKE_LENGTHS = (20, 16)
+HANDSHAKE_DIGESTS = (b"md5", b"sha256", b"sha384", b"sha3_256", b"sha3_384")
+
+# how many messages a connection may have waiting before we stop reading from it
+MAX_PENDING_MESSAGES = 16
+
+
+def frame_message(data):
+    if len(data) > 0x7FFFFFFF:
+        return struct.pack("!iQ", -1, len(data)) + data
+    return struct.pack("!i", len(data)) + data
+
+
+def challenge_response(authkey, message):
+    """Digest answering a challenge, supporting both the legacy md5 handshake and
+    the ``{digest}`` prefixed messages introduced in python 3.12
+
+    Legacy challenges are random bytes that may start with ``{`` too, so they
+    are told apart by their length as the stdlib does.
+
+    Raises:
+        AuthenticationError: if the message names no supported digest
+    """
+    if len(message) in LEGACY_HANDSHAKE_LENGTHS:
+        return hmac.new(authkey, message, "md5").digest()
+    end = message.find(b"}")
+    if message[:1] != b"{" or message[1:end] not in HANDSHAKE_DIGESTS:
+        raise AuthenticationError("unsupported challenge {!r}".format(message[:20]))
+    digest_name = message[1:end].decode("ascii")
+    return message[: end + 1] + hmac.new(authkey, message, digest_name).digest()
+
+
+class VoiceRpcProtocol(asyncio.Protocol if asyncio is not None else object):
+    """Serves a single client connection of the AsyncRPCServer
+
+    Requests of a connection are executed one at a time and in order on the
+    executor of the server, the responses written back from the event loop.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = bytearray()
+        self.pending = []
+        self.busy = False
+        self.challenge = None
+        self.state = "ready" if server.authkey is None else "verify"
+        self.sender = lambda data: server.loop.call_soon_threadsafe(self.send, data)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.protocols.add(self)
+        logger.debug("client %s connected", self)
+        if self.state == "verify":
+            self.challenge = os.urandom(20)
+            self.send(CHALLENGE + self.challenge)
+
+    def connection_lost(self, exc):
+        logger.debug("client %s disconnected ", self)
+        self.server.protocols.discard(self)
+        self.server.unsubscribe(self.sender)
+        self.pending = []
+
+    def send(self, data):
+        self.transport.write(frame_message(data))
+
+    def data_received(self, data):
+        self.buffer += data
+        while not self.transport.is_closing():
+            message = self.next_message()
+            if message is None:
+                break
+            if self.state == "ready":
+                self.pending.append(message)
+                self.process_next()
+            else:
+                self.handshake(message)
+        if len(self.pending) > MAX_PENDING_MESSAGES:
+            self.transport.pause_reading()
+
+    def next_message(self):
+        if len(self.buffer) < 4:
+            return None
+        (size,) = struct.unpack_from("!i", self.buffer)
+        header = 4
+        if size == -1:
+            if len(self.buffer) < 12:
+                return None
+            (size,) = struct.unpack_from("!Q", self.buffer, 4)
+            header = 12
+        if self.state != "ready" and size > MAX_HANDSHAKE_MESSAGE:
+            logger.debug("client %s sent an oversized handshake message", self)
+            self.transport.close()
+            return None
+        if len(self.buffer) < header + size:
+            return None
+        message = bytes(self.buffer[header : header + size])
+        del self.buffer[: header + size]
+        return message
+
+    def handshake(self, message):
+        authkey = self.server.authkey
+        if self.state == "verify":
+            if hmac.compare_digest(challenge_response(authkey, self.challenge), message):
+                self.send(WELCOME)
+                self.state = "answer"
+            else:
+                self.send(FAILURE)
+                self.transport.close()
+        elif self.state == "answer":
+            if message[: len(CHALLENGE)] != CHALLENGE:
+                self.transport.close()
+                return
+            try:
+                response = challenge_response(authkey, message[len(CHALLENGE) :])
+            except AuthenticationError as e:
+                logger.debug("client %s failed the handshake: %s", self, e)
+                self.transport.close()
+                return
+            self.send(response)
+            self.state = "welcome"
+        elif self.state == "welcome":
+            if message != WELCOME:
+                self.transport.close()
+                return
+            self.state = "ready"
+
+    def process_next(self):
+        if self.busy or not self.pending:
+            return
+        self.busy = True
+        data = self.pending.pop(0)
+        if len(self.pending) <= MAX_PENDING_MESSAGES // 2:
+            self.transport.resume_reading()
+        future = self.server.loop.run_in_executor(
+            self.server.executor, self.server.handle_message, data, self.sender
+        )
+        future.add_done_callback(self.on_response)
+
+    def on_response(self, future):
+        self.busy = False
+        if future.cancelled() or self.transport.is_closing():
+            return
+        if future.exception() is not None:
+            logger.error("Failed to handle request: %s", future.exception())
+        elif future.result():
+            self.send(future.result().json.encode())
+        self.process_next()
+
+
+class AsyncRPCServer(DispatcherMixin):
+    """Serves all clients of a service from a single asyncio event loop, running
+    on its own thread, over a unix socket"""
+
+    def __init__(self, server_address, RequestHandlerClass=None, authkey=None):
+        self.server_address = server_address
+        self.authkey = authkey
+        self.loop = None
+        self.server = None
+        self.executor = None
+        self.protocols = set()
+
+    def serve_forever(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(POOL_WORKERS)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        self.server = self.loop.run_until_complete(
+            self.loop.create_unix_server(
+                lambda: VoiceRpcProtocol(self), path=self.server_address
+            )
+        )
+        t = threading.Thread(target=self.loop.run_forever)
+        t.daemon = True
+        t.start()
+
+    def server_close(self):
+        self.loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        self.server.close()
+        for protocol in list(self.protocols):
+            protocol.transport.close()
+        self.executor.shutdown(wait=False)
+        self.loop.stop()
 
 
 CREDENTIALS_FILE = os.path.expanduser(os.path.join("~", ".voicerpc.json"))
@@ -135,18 +799,127 @@ def get_server_path(service):
         return os.path.expanduser(os.path.join("~/.voicerpc/{}.sock".format(service)))
 
 
-def get_or_create_server(service):
-    server = SERVERS.get(service, None)
-    if server is None:
-        server = RPCServer(
+class BrokerSubscription(DispatcherMixin):
+    """Stands in for the server of a service whose socket is already owned by
+    another recognizer process (the broker).
+
+    The broker forwards every message it receives from the editors over our
+    connection, which we handle with our own dispatcher without responding, so
+    the editors never learn about our failures. Our methods may notify the
+    broker through ``notify_broker`` instead. If the broker goes away, we take
+    over the socket ourselves.
+    """
+
+    def __init__(self, service, connection):
+        self.service = service
+        self.server_address = get_server_path(service)
+        self.connection = connection
+        self.send = locked_sender(connection)
+
+    def notify(self, method, params):
+        """Send a notification to the broker, returns whether it was sent"""
+        message = {"jsonrpc": "2.0", "method": method, "params": params}
+        try:
+            self.send(json.dumps(message).encode())
+        except (EOFError, IOError, ValueError):
+            return False
+        return True
+
+    def serve_forever(self):
+        self.send(
+            json.dumps({"jsonrpc": "2.0", "id": 0, "method": SUBSCRIBE_METHOD}).encode()
+        )
+        t = threading.Thread(target=self._receive)
+        t.daemon = True
+        t.start()
+
+    def server_close(self):
+        self.connection.close()
+
+    def _receive(self):
+        while True:
+            try:
+                data = self.connection.recv_bytes()
+            except (EOFError, IOError):
+                break
+            request, error = parse_message(data)
+            if error is None:
+                response = JSONRPCResponseManager.handle_request(request, self.dispatcher)
+                if getattr(response, "error", None):
+                    logger.warning(
+                        "Failed to handle %s forwarded by the broker of service %s: %s",
+                        getattr(request, "method", "batch"),
+                        self.service,
+                        response.error,
+                    )
+        if SERVERS.get(self.service) is not self:
+            return
+        logger.info("Broker for service %s went away, taking over", self.service)
+        # avoid every subscriber racing for the socket at the same moment
+        time.sleep(random.uniform(0, 0.5))
+        SERVERS[self.service] = start_server(self.service, self.dispatcher, self.lane_keys)
+
+
+def notify_broker(method, params, service="default"):
+    """Send a notification to the broker of a service, if this process is
+    subscribed to one instead of serving the service itself
+
+    Returns:
+        bool: whether the notification was sent
+    """
+    server = SERVERS.get(service)
+    if not isinstance(server, BrokerSubscription):
+        return False
+    return server.notify(method, params)
+
+
+def connect_to_broker(service):
+    try:
+        return Client(get_server_path(service), authkey=get_credentials(service))
+    except (AuthenticationError, EOFError, IOError, OSError):
+        return None
+
+
+def start_server(service, dispatcher=None, lane_keys=None):
+    connection = connect_to_broker(service) if ENABLE_BROKER else None
+    if connection is not None:
+        server = BrokerSubscription(service, connection)
+        logger.info(
+            "Service %s is already served at %s, subscribed to it",
+            service,
+            server.server_address,
+        )
+    else:
+        server_class = RPCServer
+        if SERVER_ENGINE == "pooled" and wait is not None:
+            server_class = PooledRPCServer
+        elif SERVER_ENGINE == "asyncio" and asyncio is not None and os.name != "nt":
+            server_class = AsyncRPCServer
+        server = server_class(
             get_server_path(service),
             JsonRpcRequestHandler,
             authkey=get_credentials(service),
         )
-        server.serve_forever()
         logger.info(
             "Server for service %s started at %s", service, server.server_address
         )
+        if RECORD_TRAFFIC_FILE is not None:
+            server.recorder = TrafficRecorder(RECORD_TRAFFIC_FILE.format(service=service))
+            logger.info("Recording traffic of service %s to %s", service, server.recorder.path)
+    if dispatcher is not None:
+        server._dispatcher = dispatcher
+    if lane_keys is not None:
+        server._lane_keys = lane_keys
+    server.add_method(negotiate, NEGOTIATE_METHOD)
+    server.add_method(get_stats, "get_stats")
+    server.serve_forever()
+    return server
+
+
+def get_or_create_server(service):
+    server = SERVERS.get(service, None)
+    if server is None:
+        server = start_server(service)
         SERVERS[service] = server
     return server
 
@@ -154,3 +927,16 @@ def get_or_create_server(service):
 def add_method(service="default"):
     server = get_or_create_server(service)
     return server.add_method
+
+
+def add_lane_key(key, service="default"):
+    """Decorator executing the requests of a method in the lane ``key`` picks
+    for their params, in order with the other requests of that lane, when the
+    server is the pooled one"""
+    server = get_or_create_server(service)
+
+    def decorator(method):
+        server.add_lane_key(method.__name__, key)
+        return method
+
+    return decorator
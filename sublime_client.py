@@ -1,10 +1,46 @@
 import json
+import logging
 import os
 import platform
 import subprocess
+import threading
+import time
+from multiprocessing.connection import Client
 
+try: # python 2
+    from Queue import Queue
+except ImportError: # python 3
+    from queue import Queue
 
-def validate_subl():
+try: # python 3
+    from shutil import which
+except ImportError: # python 2
+    from distutils.spawn import find_executable as which
+
+try:
+    from pyvoice_caster.rpc import get_credentials, get_server_path
+except ImportError:
+    from caster_user_content.rules.pyvoice_caster.rpc import (get_credentials,
+                                                              get_server_path)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Service name under which an optional companion plugin inside sublime listens for
+# commands, using the same voicerpc transport the editors use to send us hints
+SUBLIME_SERVICE = "sublime"
+
+# How long to wait before trying again to connect to the companion plugin, in seconds
+CHANNEL_RETRY_SECONDS = 5.0
+
+# How long to wait for the companion plugin to acknowledge a synchronous command
+CHANNEL_TIMEOUT_SECONDS = 1.0
+
+# Where the location of subl is remembered between boots
+SUBL_CACHE_FILE = os.path.expanduser(os.path.join("~", ".voicerpc", "subl.json"))
+
+
+def subl_candidates():
     if platform.system() == "Windows":
         candidates = [
             "subl",
@@ -20,7 +56,11 @@ def validate_subl():
         ]
     else:
         candidates = ["subl"]
-    for candidate in candidates:
+    return candidates
+
+
+def validate_subl():
+    for candidate in subl_candidates():
         try:
             subprocess.check_call(
                 [candidate, "-h"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
@@ -34,12 +74,219 @@ def validate_subl():
         )
 
 
-subl = validate_subl()
+def subl_mtime(candidate):
+    path = which(candidate)
+    if path is None:
+        return None
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def load_cached_subl():
+    """Return the location of subl found during a previous boot, provided the
+    executable has not been modified since"""
+    try:
+        with open(SUBL_CACHE_FILE) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+    candidate = cached.get("path")
+    if candidate not in subl_candidates():
+        return None
+    if cached.get("mtime") is None or subl_mtime(candidate) != cached["mtime"]:
+        return None
+    return candidate
+
+
+def save_cached_subl(candidate):
+    try:
+        if not os.path.exists(os.path.dirname(SUBL_CACHE_FILE)):
+            os.makedirs(os.path.dirname(SUBL_CACHE_FILE))
+        with open(SUBL_CACHE_FILE, "w") as f:
+            json.dump({"path": candidate, "mtime": subl_mtime(candidate)}, f)
+    except (IOError, OSError):
+        logger.debug("Failed to cache location of subl", exc_info=True)
+
+
+subl = None
+subl_lock = threading.Lock()
+
+
+def get_subl():
+    """Locate subl on first use
+
+    A location cached from a previous boot is used right away and checked again
+    in the background, so only the very first boot pays for probing candidates
+    """
+    global subl
+    with subl_lock:
+        if subl is None:
+            subl = load_cached_subl()
+            if subl is not None:
+                t = threading.Thread(target=revalidate_subl)
+                t.daemon = True
+                t.start()
+            else:
+                subl = validate_subl()
+                save_cached_subl(subl)
+        return subl
+
+
+def revalidate_subl():
+    global subl
+    try:
+        candidate = validate_subl()
+    except ValueError:
+        logger.warning("Cached location of subl %s is no longer valid", subl)
+        candidate = None
+    with subl_lock:
+        subl = candidate
+    if candidate is not None:
+        save_cached_subl(candidate)
+
+
+class SublimeChannel(object):
+    """Persistent connection to the companion plugin, if one is running
+
+    Commands are sent as JSON-RPC ``run_command`` requests, avoiding the cost of
+    spawning ``subl`` for every command. While the plugin is unreachable, we only
+    retry connecting every ``CHANNEL_RETRY_SECONDS``.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.connection = None
+        self.retry_at = 0
+        self.request_id = 0
+
+    def connect(self):
+        if self.connection is None and time.time() >= self.retry_at:
+            try:
+                self.connection = Client(
+                    get_server_path(self.service),
+                    authkey=get_credentials(self.service),
+                )
+                logger.info("Connected to sublime companion plugin")
+            except Exception:
+                self.retry_at = time.time() + CHANNEL_RETRY_SECONDS
+        return self.connection is not None
+
+    def disconnect(self):
+        try:
+            self.connection.close()
+        except (EOFError, IOError):
+            pass
+        self.connection = None
+        self.retry_at = time.time() + CHANNEL_RETRY_SECONDS
+
+    def send(self, c, payload, synchronous):
+        """Send a command over the channel
+
+        Returns:
+            bool: whether the command was delivered, if not the caller should
+            fall back to ``subl``
+        """
+        if not self.connect():
+            return False
+        self.request_id += 1
+        message = '{{"jsonrpc": "2.0", "method": "run_command", "params": [{}, {}]{}}}'.format(
+            json.dumps(c),
+            payload,
+            ', "id": {}'.format(self.request_id) if synchronous else "",
+        )
+        try:
+            self.connection.send_bytes(message.encode("utf-8"))
+        except (EOFError, IOError) as e:
+            logger.info("Lost connection to sublime companion plugin: %s", e)
+            self.disconnect()
+            return False
+        # from here on the command has been sent, so it must not be repeated
+        # through subl even if its acknowledgement never arrives
+        if synchronous:
+            self.wait_for(self.request_id)
+        return True
+
+    def wait_for(self, request_id):
+        """Wait for the acknowledgement of a command, skipping the late ones of
+        commands we already stopped waiting for"""
+        deadline = time.time() + CHANNEL_TIMEOUT_SECONDS
+        try:
+            while self.connection.poll(max(0, deadline - time.time())):
+                response = json.loads(self.connection.recv_bytes().decode("utf-8"))
+                if response.get("id") == request_id:
+                    return
+                logger.info(
+                    "Late acknowledgement of sublime command %s", response.get("id")
+                )
+        except (EOFError, IOError, ValueError) as e:
+            logger.info("Lost connection to sublime companion plugin: %s", e)
+            self.disconnect()
+            return
+        logger.warning(
+            "Sublime companion plugin did not acknowledge command %s within %s seconds, "
+            "assuming it was delivered",
+            request_id,
+            CHANNEL_TIMEOUT_SECONDS,
+        )
+
+
+channel = SublimeChannel(SUBLIME_SERVICE)
+
+
+class SublimeSender(object):
+    """Delivers commands from a background thread, in the order they were issued
+
+    Asynchronous commands return right away, while synchronous ones wait until
+    they have been delivered
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, c, payload, synchronous):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        done = threading.Event() if synchronous else None
+        result = []
+        self.queue.put((c, payload, synchronous, done, result))
+        if done is None:
+            return None
+        done.wait()
+        return result[0] if result else None
+
+    def run(self):
+        while True:
+            c, payload, synchronous, done, result = self.queue.get()
+            try:
+                result.append(deliver(c, payload, synchronous))
+            except Exception:
+                logger.exception("Failed to send command %s to sublime", c)
+            finally:
+                if done is not None:
+                    done.set()
+
+
+sender = SublimeSender()
+
+
+def send_sublime(c, data, synchronous=True):
+    # dict handles the read only mappings used for the items of the dynamic lists
+    payload = json.dumps(data, default=dict)
+    print("send_sublime", c, payload)
+    return sender.submit(c, payload, synchronous)
 
 
-def send_sublime(c, data):
-    print("send_sublime", c, json.dumps(data))
-    command = [subl, "-b", "--command", c + " " + json.dumps(data)]
+def deliver(c, payload, synchronous):
+    if channel.send(c, payload, synchronous):
+        return 0
+    command = [get_subl(), "-b", "--command", c + " " + payload]
     # Adopted from https://dragonfly2.readthedocs.io/en/latest/_modules/dragonfly/actions/action_cmd.html#RunCommand
     import subprocess
 
@@ -0,0 +1,323 @@
+import copy
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import types
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_dict_lists():
+    """Import dict_lists against a minimal dragonfly, with its rpc methods
+    registered on a bare dispatcher instead of a server socket"""
+    if "dragonfly" not in sys.modules:
+
+        class DictList(dict):
+            def __init__(self, name, *args, **kwargs):
+                dict.__init__(self, *args, **kwargs)
+                self.name = name
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def set(self, other):
+                self.clear()
+                self.update(other)
+
+        class DictListRef(object):
+            def __init__(self, name, dict_list, key=None, default=None):
+                self.name = name
+                self.list = dict_list
+
+        dragonfly = types.ModuleType("dragonfly")
+        dragonfly.DictList = DictList
+        dragonfly.DictListRef = DictListRef
+        sys.modules["dragonfly"] = dragonfly
+    if "pyvoice_caster" not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            "pyvoice_caster",
+            os.path.join(ROOT, "__init__.py"),
+            submodule_search_locations=[ROOT],
+        )
+        package = importlib.util.module_from_spec(spec)
+        sys.modules["pyvoice_caster"] = package
+        spec.loader.exec_module(package)
+    rpc = importlib.import_module("pyvoice_caster.rpc")
+    rpc.SERVERS.setdefault("default", rpc.DispatcherMixin())
+    dict_lists = importlib.import_module("pyvoice_caster.dict_lists")
+    dict_lists.WARM_START_DIR = None
+    dict_lists.COMPILE_TIME_TARGET_SECONDS = None
+    dict_lists.scheduler.quiet_window = 0
+    return dict_lists
+
+
+dict_lists = load_dict_lists()
+
+
+def items(*names):
+    return [{"spoken": name, "value": name} for name in names]
+
+
+class LayeredListsTest(unittest.TestCase):
+    def setUp(self):
+        dict_lists.lists.pop("expression", None)
+        dict_lists.forget_layers("expression")
+        for state in (dict_lists.versions, dict_lists.fingerprints):
+            state.pop("expression", None)
+        self.expression = dict_lists.dynamic_list("expression")
+
+    def test_layers_merge_by_precedence(self):
+        dict_lists.enhance_spoken("expression.module", items("a", "b"))
+        dict_lists.enhance_spoken("expression.local", items("b", "c"))
+        self.assertEqual(sorted(self.expression), ["a", "b", "c"])
+        dict_lists.enhance_spoken("expression.local", items("c"))
+        self.assertEqual(sorted(self.expression), ["a", "b", "c"])
+        dict_lists.enhance_spoken("expression.module", items())
+        self.assertEqual(sorted(self.expression), ["c"])
+
+    def test_layer_push_after_full_push_is_applied(self):
+        dict_lists.enhance_spoken("expression.local", items("a", "b"))
+        dict_lists.enhance_spoken("expression", items("x"))
+        result = dict_lists.enhance_spoken("expression.local", items("a", "b"))
+        self.assertFalse(result["skipped"])
+        self.assertEqual(sorted(self.expression), ["a", "b", "x"])
+
+    def test_layer_delta_after_full_push_requests_resync(self):
+        dict_lists.enhance_spoken("expression.local", items("a", "b"), version=2)
+        dict_lists.enhance_spoken("expression", items("x"))
+        result = dict_lists.enhance_spoken_delta("expression.local", items("c"), [], 3)
+        self.assertTrue(result["resync"])
+        self.assertEqual(sorted(self.expression), ["x"])
+
+    def test_full_push_after_layer_push_is_applied(self):
+        dict_lists.enhance_spoken("expression", items("x"))
+        dict_lists.enhance_spoken("expression.local", items("l"))
+        result = dict_lists.enhance_spoken("expression", items("x"))
+        self.assertFalse(result["skipped"])
+        self.assertEqual(sorted(self.expression), ["x"])
+
+    def test_full_push_after_layer_delta_is_applied(self):
+        dict_lists.enhance_spoken("expression", items("x"))
+        dict_lists.enhance_spoken("expression.local", items("l"), version=1)
+        dict_lists.enhance_spoken_delta("expression.local", items("m"), [], 2)
+        result = dict_lists.enhance_spoken("expression", items("x"))
+        self.assertFalse(result["skipped"])
+        self.assertEqual(sorted(self.expression), ["x"])
+
+    def test_applied_sequence_follows_layer_pushes(self):
+        result = dict_lists.enhance_spoken("expression.local", items("a"))
+        self.assertEqual(
+            dict_lists.get_applied_sequence("expression.local"), result["sequence"]
+        )
+        self.assertEqual(dict_lists.get_applied_sequence("expression"), result["sequence"])
+
+    def test_delta_after_resync_request_is_rejected(self):
+        dict_lists.enhance_spoken("expression", items("a"), version=1)
+        dict_lists.request_resync("expression")
+        result = dict_lists.enhance_spoken_delta("expression", items("b"), [], 2)
+        self.assertTrue(result["resync"])
+        self.assertEqual(sorted(self.expression), ["a"])
+
+    def test_layers_share_the_budget_of_their_list(self):
+        dict_lists.LIST_ITEM_BUDGETS["expression"] = 3
+        self.addCleanup(dict_lists.LIST_ITEM_BUDGETS.clear)
+        dict_lists.enhance_spoken("expression.module", items("a", "b"))
+        dict_lists.enhance_spoken("expression.class", items("c", "d"))
+        dict_lists.enhance_spoken("expression.local", items("e", "f"))
+        self.assertEqual(len(self.expression), 3)
+        self.assertEqual(dict_lists.dropped_items["expression.local"], 2)
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.expression = dict_lists.dynamic_list("expression")
+
+    def test_failed_update_is_not_reported_as_applied(self):
+        def fail(dict_list):
+            raise RuntimeError("engine refused the list")
+
+        scheduler = dict_lists.scheduler
+        applied = dict_lists.get_applied_sequence("expression")
+        self.assertRaises(RuntimeError, scheduler.submit, "expression", fail)
+        self.assertEqual(dict_lists.get_applied_sequence("expression"), applied)
+        scheduler.submit("expression", dict_lists.update_items(items("a"), []))
+        self.assertEqual(dict_lists.get_applied_sequence("expression"), applied)
+        sequence = dict_lists.enhance_spoken("expression", items("b"))["sequence"]
+        self.assertEqual(dict_lists.get_applied_sequence("expression"), sequence)
+
+class GovernorTest(unittest.TestCase):
+    def setUp(self):
+        self.subsymbol = dict_lists.dynamic_list("subsymbol")
+        dict_lists.versions.pop("subsymbol", None)
+        dict_lists.LIST_ITEM_BUDGETS["subsymbol"] = 2
+        self.addCleanup(dict_lists.LIST_ITEM_BUDGETS.clear)
+
+    def test_delta_is_truncated_to_the_budget(self):
+        dict_lists.enhance_spoken("subsymbol", items("a", "b"), version=1)
+        result = dict_lists.enhance_spoken_delta("subsymbol", items("c", "d", "e"), ["a"], 2)
+        self.assertEqual(len(self.subsymbol), 2)
+        self.assertEqual(result["dropped"], 2)
+        self.assertEqual(dict_lists.dropped_items["subsymbol"], 2)
+
+    def test_delta_within_the_budget_drops_nothing(self):
+        dict_lists.enhance_spoken("subsymbol", items("a", "b"), version=1)
+        result = dict_lists.enhance_spoken_delta("subsymbol", items("c"), ["a"], 2)
+        self.assertEqual(sorted(self.subsymbol), ["b", "c"])
+        self.assertEqual(result["dropped"], 0)
+
+class SnapshotCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.expression = dict_lists.dynamic_list("expression")
+
+    def test_metadata_without_file_is_not_cached(self):
+        dict_lists.enhance_spoken("expression", items("p"), metadata={"project": "/p"})
+        self.assertIsNone(dict_lists.snapshots.get({"file_uri": None, "scope": None}))
+
+    def test_push_for_file_is_restored(self):
+        metadata = {"file_uri": "file:///a.py", "scope": "f"}
+        dict_lists.enhance_spoken("expression", items("a"), metadata=metadata)
+        dict_lists.enhance_spoken("expression", items("b"))
+        dict_lists.restore_spoken("file:///a.py", "f")
+        self.assertEqual(sorted(self.expression), ["a"])
+
+
+
+class ChunkedUploadTest(unittest.TestCase):
+    def setUp(self):
+        dict_lists.uploads.clear()
+        dict_lists.fingerprints.pop("importable", None)
+        self.importable = dict_lists.dynamic_list("importable")
+
+    def test_chunks_are_swapped_in_on_commit(self):
+        upload_id = dict_lists.begin_list("importable", "a", version=1)
+        self.assertEqual(dict_lists.append_list_chunk(upload_id, items("a", "b")), 2)
+        self.assertEqual(dict_lists.append_list_chunk(upload_id, items("c")), 3)
+        self.assertNotIn("c", self.importable)
+        result = dict_lists.commit_list(upload_id)
+        self.assertFalse(result["skipped"])
+        self.assertEqual(sorted(self.importable), ["a", "b", "c"])
+        self.assertNotIn("importable", dict_lists.uploads)
+
+    def test_upload_with_same_fingerprint_is_skipped(self):
+        for nonce in ("a", "b"):
+            upload_id = dict_lists.begin_list("importable", nonce)
+            dict_lists.append_list_chunk(upload_id, items("a", "b"))
+            result = dict_lists.commit_list(upload_id)
+        self.assertTrue(result["skipped"])
+        self.assertEqual(sorted(self.importable), ["a", "b"])
+
+    def test_unknown_upload_id_raises_key_error(self):
+        upload_id = dict_lists.begin_list("importable", "a")
+        dict_lists.commit_list(upload_id)
+        self.assertRaises(KeyError, dict_lists.append_list_chunk, upload_id, items("a"))
+        self.assertRaises(KeyError, dict_lists.commit_list, upload_id)
+        self.assertRaises(KeyError, dict_lists.commit_list, "upload:missing:a")
+
+    def test_newer_upload_supersedes_unfinished_one(self):
+        first = dict_lists.begin_list("importable", "a")
+        second = dict_lists.begin_list("importable", "b")
+        self.assertNotEqual(first, second)
+        self.assertRaises(ValueError, dict_lists.append_list_chunk, first, items("a"))
+        dict_lists.append_list_chunk(second, items("b"))
+        self.assertRaises(ValueError, dict_lists.commit_list, first)
+        dict_lists.commit_list(second)
+        self.assertEqual(sorted(self.importable), ["b"])
+
+class SpokenItemTest(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "spoken": "join",
+            "module": "os.path",
+            "name": "join",
+            "score": 2,
+            "tags": ["function"],
+        }
+        self.item = dict_lists.SpokenItem(self.data, {})
+
+    def test_behaves_like_the_pushed_dict(self):
+        self.assertEqual(self.item["module"], "os.path")
+        self.assertEqual(self.item.get("value", "missing"), "missing")
+        self.assertNotIn("value", self.item)
+        self.assertRaises(KeyError, lambda: self.item["value"])
+        self.assertEqual(len(self.item), 5)
+        self.assertEqual(dict(self.item), self.data)
+        self.assertEqual(self.item, self.data)
+
+    def test_extra_keys_are_kept(self):
+        self.assertEqual(self.item["score"], 2)
+        self.assertEqual(self.item["tags"], ["function"])
+        self.assertIsNone(dict_lists.SpokenItem(items("a")[0], {}).extra)
+
+    def test_serializes_as_a_dict(self):
+        encoded = json.dumps(self.item, default=dict, sort_keys=True)
+        self.assertEqual(json.loads(encoded), self.data)
+
+    def test_deepcopy(self):
+        copied = copy.deepcopy(self.item)
+        self.assertIsInstance(copied, dict_lists.SpokenItem)
+        self.assertEqual(copied, self.item)
+        self.assertIsNot(copied["tags"], self.item["tags"])
+
+    def test_module_and_name_are_interned(self):
+        strings = {}
+        first = dict_lists.SpokenItem(self.data, strings)
+        second = dict_lists.SpokenItem(dict(self.data, module="os.path"[:]), strings)
+        self.assertIs(first["module"], second["module"])
+
+class ColumnarTest(unittest.TestCase):
+    def test_table_gives_the_same_items_as_a_list(self):
+        rpc = sys.modules["pyvoice_caster.rpc"]
+        data = [
+            {"spoken": "join", "module": "os.path", "name": "join", "score": 2},
+            {"spoken": "split", "module": "os.path", "name": "split", "score": 1},
+        ]
+        message = rpc.encode_message({"params": ["importable", data]}, "columnar")
+        table = rpc.decode_message(message)["params"][1]
+        self.assertTrue(rpc.is_table(table))
+        strings = {}
+        rows = dict(dict_lists.compact_items(table, strings))
+        self.assertEqual(rows, dict(dict_lists.compact_items(data, {})))
+        self.assertEqual(rows["join"]["score"], 2)
+        self.assertIs(rows["join"]["module"], rows["split"]["module"])
+        self.assertRaises(KeyError, lambda: rows["join"]["value"])
+
+class LaneTest(unittest.TestCase):
+    def lane(self, method, *args, **kwargs):
+        rpc = sys.modules["pyvoice_caster.rpc"]
+        request = rpc.JSONRPCRequest.from_data(
+            {"jsonrpc": "2.0", "id": 1, "method": method, "params": kwargs or list(args)}
+        )
+        return rpc.SERVERS["default"].lane_key(request)
+
+    def test_list_layers_and_uploads_share_a_lane(self):
+        self.assertEqual(self.lane("enhance_spoken", "expression.local", []), "expression")
+        self.assertEqual(self.lane("enhance_spoken_delta", list_name="expression"), "expression")
+        upload_id = dict_lists.begin_list("expression", "n")
+        self.assertEqual(self.lane("append_list_chunk", upload_id, []), "expression")
+
+    def test_other_methods_have_no_lane(self):
+        self.assertIsNone(self.lane("restore_spoken", "file:///a.py"))
+        self.assertIsNone(self.lane("enhance_spoken"))
+
+
+class ReloadTest(unittest.TestCase):
+    def test_reload_keeps_lists_and_defines_new_state(self):
+        expression = dict_lists.dynamic_list("expression")
+        dict_lists.enhance_spoken("expression", items("kept"))
+        # as if the reloaded file introduced this variable
+        del dict_lists.list_projects
+        importlib.reload(dict_lists)
+        dict_lists.WARM_START_DIR = None
+        dict_lists.scheduler.quiet_window = 0
+        self.assertEqual(dict_lists.list_projects, {})
+        self.assertIs(dict_lists.dynamic_list("expression"), expression)
+        self.assertEqual(sorted(expression), ["kept"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import hmac
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+from test_dict_lists import load_dict_lists
+
+load_dict_lists()
+import pyvoice_caster.rpc as rpc  # noqa: E402
+
+
+def request(method, params, id=1):
+    return json.dumps(
+        {"jsonrpc": "2.0", "id": id, "method": method, "params": params}
+    ).encode()
+
+
+class ChallengeResponseTest(unittest.TestCase):
+    def test_legacy_challenge_starting_with_a_brace(self):
+        message = b"{" + os.urandom(19)
+        self.assertEqual(
+            rpc.challenge_response(b"key", message),
+            hmac.new(b"key", message, "md5").digest(),
+        )
+
+    def test_prefixed_challenge(self):
+        message = b"{sha256}" + os.urandom(40)
+        self.assertEqual(
+            rpc.challenge_response(b"key", message),
+            b"{sha256}" + hmac.new(b"key", message, "sha256").digest(),
+        )
+
+    def test_unknown_digest_is_rejected(self):
+        self.assertRaises(
+            AuthenticationError,
+            rpc.challenge_response,
+            b"key",
+            b"{crc32}" + os.urandom(40),
+        )
+
+
+@unittest.skipIf(
+    rpc.asyncio is None or os.name == "nt", "needs asyncio and unix sockets"
+)
+class AsyncServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, "test.sock")
+        self.authkey = os.urandom(16)
+        self.server = rpc.AsyncRPCServer(self.address, authkey=self.authkey)
+        self.server.add_method(lambda a, b: a + b, "add")
+        self.server.serve_forever()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def connect(self, authkey):
+        client = Client(self.address, authkey=authkey)
+        self.clients.append(client)
+        return client
+
+    def test_client_calls_registered_method(self):
+        client = self.connect(self.authkey)
+        client.send_bytes(request("add", [1, 2]))
+        self.assertEqual(json.loads(client.recv_bytes())["result"], 3)
+        client.send_bytes(request("add", {"a": "x", "b": "y"}, id=2))
+        response = json.loads(client.recv_bytes())
+        self.assertEqual((response["id"], response["result"]), (2, "xy"))
+
+    def test_requests_are_answered_in_order(self):
+        client = self.connect(self.authkey)
+        for i in range(20):
+            client.send_bytes(request("add", [i, 1], id=i))
+        for i in range(20):
+            response = json.loads(client.recv_bytes())
+            self.assertEqual((response["id"], response["result"]), (i, i + 1))
+
+    def test_unknown_method_is_reported(self):
+        client = self.connect(self.authkey)
+        client.send_bytes(request("missing", []))
+        self.assertEqual(json.loads(client.recv_bytes())["error"]["code"], -32601)
+
+    def test_wrong_authkey_is_rejected(self):
+        self.assertRaises(AuthenticationError, self.connect, b"wrong key")
+        client = self.connect(self.authkey)
+        client.send_bytes(request("add", [2, 2]))
+        self.assertEqual(json.loads(client.recv_bytes())["result"], 4)
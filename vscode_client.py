@@ -1,6 +1,11 @@
+import ctypes
+import errno
 import json
 import os
+import select
+import struct
 import sys
+import threading
 import time
 from tempfile import gettempdir
 from uuid import uuid4
@@ -23,10 +28,43 @@ RPC_COMMAND_TIMEOUT_SECONDS = 3.0
 # long to sleep the first time
 MINIMUM_SLEEP_TIME_SECONDS = 0.0005
 
+# inotify events signalling that a file in the communication directory was written
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Command of the pyvoice extension that executes a list of commands and returns
+# the result of each, used to send several commands with a single keystroke
+BATCH_COMMAND_ID = "pyvoice.run_commands"
+
+# Commands queued while a batch is open, None if no batch is open
+pending_batch = None
+
+# Serializes the commands issued by this process, so that they never compete
+# among themselves for the request file
+request_lock = threading.Lock()
+
+# Whether the last command issued by this process may have left a response file
+# behind, only then do we check for an old one before issuing the next command
+response_file_dirty = True
+
 # Indicates whether a pre-phrase signal was emitted during the course of the
 # current phrase
 did_emit_pre_phrase_signal = False
 
+# libc as loaded by load_libc, False if inotify is not available
+libc = None
+
+# Watch kept open on the communication directory from one command to the next,
+# protected against reloads so that its file descriptor is not leaked
+try:
+    communication_dir_watch
+except NameError:
+    communication_dir_watch = None
+
 
 class NotSet(object):
     def __repr__(self):
@@ -40,12 +78,125 @@ class NoFileServerException(Exception):
 def write_json_exclusive(path, body):
     """Writes jsonified object to file, failing if the file already exists
 
+    The contents are written to a temporary file first, which is then hard
+    linked into place, so the file never appears partially written and an
+    existing file is never overwritten
+
     Args:
         path: The path of the file to write
         body: The object to convert to json and write
+
+    Raises:
+        OSError: With errno EEXIST if the file already exists
+    """
+    # dict handles the read only mappings used for the items of the dynamic lists
+    contents = json.dumps(body, default=dict)
+    if not hasattr(os, "link"):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        with os.fdopen(fd, "w") as out_file:
+            out_file.write(contents)
+        return
+    temp_path = "{}.{}.tmp".format(path, uuid4().hex)
+    with open(temp_path, "w") as out_file:
+        out_file.write(contents)
+    try:
+        os.link(temp_path, path)
+    finally:
+        os.unlink(temp_path)
+
+
+def load_libc():
+    """Returns libc if it provides inotify, loaded once per process, or None"""
+    global libc
+    if libc is None:
+        try:
+            # the symbols already loaded into the process, which include libc,
+            # without searching for it on disk
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.inotify_init1
+        except (OSError, AttributeError):
+            libc = False
+    return libc or None
+
+
+class DirectoryWatch(object):
+    """Wakes up as soon as a file in the given directory is written, using
+    inotify on linux
+
+    Args:
+        path: The directory to watch
+
+    Raises:
+        OSError: If inotify is not available
     """
-    with open(path, "w") as out_file:
-        out_file.write(json.dumps(body))
+
+    def __init__(self, path):
+        inotify = load_libc()
+        if inotify is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.path = path
+        self.alive = True
+        self.fd = inotify.inotify_init1(os.O_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+        if inotify.inotify_add_watch(self.fd, path.encode(), mask) < 0:
+            error_number = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error_number, "inotify_add_watch failed")
+
+    def clear(self):
+        """Discard the events received so far, like those caused by our own writes"""
+        try:
+            while True:
+                data = os.read(self.fd, 4096)
+                if not data:
+                    break
+                self._check_ignored(data)
+        except OSError:
+            # nothing left to read
+            pass
+
+    def _check_ignored(self, data):
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            if mask & IN_IGNORED:
+                # the directory was removed, the watch will never fire again
+                self.alive = False
+            offset += INOTIFY_EVENT.size + length
+
+    def wait(self, timeout):
+        """Block until a file is written or the timeout expires
+
+        Returns:
+            bool: whether any file was written
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        self.clear()
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch_directory(path):
+    """Returns the DirectoryWatch kept on the given path, set up on first use,
+    or None if inotify is not available, in which case callers should fall back
+    to polling"""
+    global communication_dir_watch
+    watch = communication_dir_watch
+    if watch is not None and (watch.path != path or not watch.alive):
+        watch.close()
+        watch = communication_dir_watch = None
+    if watch is None and is_linux():
+        try:
+            watch = communication_dir_watch = DirectoryWatch(path)
+        except OSError:
+            return None
+    return watch
 
 
 class Request:
@@ -80,7 +231,9 @@ def write_request(request, path):
     try:
         write_json_exclusive(path, request.to_dict())
         request_file_exists = False
-    except OSError:
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
         request_file_exists = True
 
     if request_file_exists:
@@ -131,20 +284,11 @@ def run_command(command_id, *args, **kwargs):
 
     communication_dir_path = get_communication_dir_path()
 
-    if not os.path.exists(communication_dir_path):
-        if args or return_command_output:
-            raise Exception("Must use command-server extension for advanced commands")
-        raise NoFileServerException("Communication directory not found")
-
-    request_path = os.path.join(communication_dir_path, "request.json")
-    response_path = os.path.join(communication_dir_path, "response.json")
-
     # Generate uuid that will be mirrored back to us by command server for
     # sanity checking
     uuid = str(uuid4())
     print("uuid", uuid)
     print("args", args)
-    print("request_path", request_path)
     request = Request(
         command_id=command_id,
         args=args,
@@ -153,14 +297,47 @@ def run_command(command_id, *args, **kwargs):
         uuid=uuid,
     )
 
+    with request_lock:
+        return execute_request(request, communication_dir_path)
+
+
+def execute_request(request, communication_dir_path):
+    """Writes the request, triggers the command server and waits for its response
+
+    Args:
+        request: The request to execute
+        communication_dir_path: The directory used to communicate with the command server
+
+    Returns:
+        Object: The response from the command
+    """
+    global response_file_dirty
+    request_path = os.path.join(communication_dir_path, "request.json")
+    response_path = os.path.join(communication_dir_path, "response.json")
+    print("request_path", request_path)
+
     # First, write the request to the request file, which makes us the sole
     # owner because all other processes will try to open it with 'x'
-    write_request(request, request_path)
+    try:
+        write_request(request, request_path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        if request.args or request.return_command_output:
+            raise Exception("Must use command-server extension for advanced commands")
+        raise NoFileServerException("Communication directory not found")
 
     # We clear the response file if it does exist, though it shouldn't
-    if os.path.exists(response_path):
+    if response_file_dirty and os.path.exists(response_path):
         print("WARNING: Found old response file")
         robust_unlink(response_path)
+    response_file_dirty = True
+
+    # Watch before triggering the command, so that we cannot miss the response
+    # being written, but only for events caused by it
+    watch = watch_directory(communication_dir_path)
+    if watch is not None:
+        watch.clear()
 
     # Then, perform keystroke telling the application to execute the command in the
     # request file.  Because only the active application instance will accept
@@ -168,26 +345,83 @@ def run_command(command_id, *args, **kwargs):
     # one to execute the command.
     Actions.trigger_command_server_command_execution()  # Commented as it's not clear where Actions is defined
 
-    # try:
-    #     decoded_contents = read_json_with_timeout(response_path)
-    # finally:
-    #     # NB: We remove the response file first because we want to do this while we
-    #     # still own the request file
-    #     robust_unlink(response_path)
-    #     robust_unlink(request_path)
+    try:
+        decoded_contents = read_json_with_timeout(response_path, watch)
+    finally:
+        # NB: We remove the response file first because we want to do this while we
+        # still own the request file
+        try:
+            robust_unlink(response_path)
+        except FileNotFoundError:
+            pass
+        response_file_dirty = False
+        robust_unlink(request_path)
+
+    if decoded_contents["uuid"] != request.uuid:
+        raise Exception("uuids did not match")
 
-    # if decoded_contents["uuid"] != uuid:
-    #     raise Exception("uuids did not match")
+    for warning in decoded_contents["warnings"]:
+        print("WARNING:", warning)
 
-    # for warning in decoded_contents["warnings"]:
-    #     print("WARNING:", warning)
+    if decoded_contents["error"] is not None:
+        raise Exception(decoded_contents["error"])
 
-    # if decoded_contents["error"] is not None:
-    #     raise Exception(decoded_contents["error"])
+    return decoded_contents["returnValue"]
 
-    # time.sleep(0.025)
 
-    # return decoded_contents["returnValue"]
+def run_commands(commands, **kwargs):
+    """Runs several commands with a single request, executed in order by the
+    BATCH_COMMAND_ID command of the pyvoice extension
+
+    Args:
+        commands: Iterable of (command_id, args) tuples.
+        kwargs: Same as run_command
+
+    Returns:
+        List[Object]: The response of each command, if requested.
+    """
+    batch = [{"commandId": command_id, "args": list(args)} for command_id, args in commands]
+    return run_command(BATCH_COMMAND_ID, batch, **kwargs)
+
+
+def begin_batch():
+    """Start gathering commands passed to queue_command instead of running them"""
+    global pending_batch
+    pending_batch = []
+
+
+def queue_command(command_id, *args):
+    """Add a command to the open batch
+
+    Returns:
+        bool: False if no batch is open, in which case the caller should run the
+        command directly
+    """
+    if pending_batch is None:
+        return False
+    pending_batch.append((command_id, args))
+    return True
+
+
+def flush_batch():
+    """Close the open batch and send its commands with a single request
+
+    Returns:
+        List[Object]: The response of each command
+    """
+    global pending_batch
+    commands, pending_batch = pending_batch, None
+    if not commands:
+        return []
+    if len(commands) == 1:
+        command_id, args = commands[0]
+        return [run_command(command_id, *args, return_command_output=True)]
+    return run_commands(commands, return_command_output=True)
+
+
+def discard_batch():
+    global pending_batch
+    pending_batch = None
 
 
 def get_communication_dir_path():
@@ -229,12 +463,14 @@ def robust_unlink(path):
             raise e
 
 
-def read_json_with_timeout(path):
+def read_json_with_timeout(path, watch=None):
     """Repeatedly tries to read a json object from the given path, waiting
     until there is a trailing new line indicating that the write is complete
 
     Args:
         path: The path to read from
+        watch (DirectoryWatch, optional): Watch on the parent directory, used to
+            wake up as soon as the file is written instead of polling
 
     Raises:
         Exception: If we timeout waiting for a response
@@ -255,7 +491,10 @@ def read_json_with_timeout(path):
             # If not found, keep waiting
             pass
 
-        time.sleep(sleep_time)
+        if watch is not None:
+            watch.wait(max(timeout_time - time.perf_counter(), 0))
+        else:
+            time.sleep(sleep_time)
 
         time_left = timeout_time - time.perf_counter()
 